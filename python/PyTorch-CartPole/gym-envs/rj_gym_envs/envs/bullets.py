@@ -6,7 +6,6 @@ Based originally on gym cart-pole system implemented by Rich Sutton et al.
 import math
 import gym
 from gym import spaces, logger
-from gym.envs.classic_control import rendering as rend
 # from gym.utils import seeding
 import numpy as np
 # import pyglet
@@ -20,6 +19,14 @@ WINDOW_DISPLAY_SCALE = 4    # Zoom, must be integer. Actual displayed window wid
 FPS = 50                    # Frames per second
 
 
+def get_rendering():
+    """
+    Import gym rendering only once something is actually drawn, so headless training never needs pyglet or a display.
+    """
+    from gym.envs.classic_control import rendering
+    return rendering
+
+
 class BulletsEnv(gym.Env):
     """
     Description:
@@ -173,7 +180,7 @@ class BulletsEnv(gym.Env):
 
         logger.info(f'Steps taken: {self.steps_taken} Reward moving: {self.reward_twenty}')
 
-        self.state = self.render("state_pixels")
+        self.state = self.get_state_pixels()
 
         return np.array(self.state), reward, done, {}
 
@@ -181,14 +188,43 @@ class BulletsEnv(gym.Env):
         self.player_ship.reset()
         self.boss_ship.reset()
         self.bullet_engine.reset()
-        self.state = self.render("state_pixels")
+        self.state = self.get_state_pixels()
         self.steps_taken = 0
         self.steps_beyond_done = None
         self.reward_twenty = 0
         return np.array(self.state)
 
+    def get_state_pixels(self):
+        """
+        Build the observation straight from ship and bullet positions, without rendering anything.
+
+        :return: State pixels as described by the observation space.
+        :rtype: np.ndarray
+        """
+        state_pixels = np.zeros(shape=(STATE_W, STATE_H, 6), dtype=np.int8)
+
+        # Add ship presence to state
+        ship_xy_data = self.player_ship.get_xy_positions()
+        state_pixels[ship_xy_data[:, 0], ship_xy_data[:, 1], 0] = 1
+        ship_xy_data = self.boss_ship.get_xy_positions()
+        state_pixels[ship_xy_data[:, 0], ship_xy_data[:, 1], 1] = 1
+
+        # Add bullet hp and damage to state, the last bullet on a pixel wins.
+        # Fancy assignment with repeated indices picks any of them, so only the last of each pixel is assigned.
+        for bullets, channel in [(self.bullet_engine.player_bullets, 2), (self.bullet_engine.boss_bullets, 4)]:
+            _, last_from_end = np.unique(bullets.get_pixel_keys()[::-1], return_index=True)
+            last = len(bullets) - 1 - last_from_end
+            state_pixels[bullets.x[last], bullets.y[last], channel] = bullets.hp[last]
+            state_pixels[bullets.x[last], bullets.y[last], channel + 1] = bullets.damage[last]
+
+        return state_pixels
+
     def render(self, mode='human'):
         assert mode in ['human', 'rgb_array', 'state_pixels']
+        if mode == 'state_pixels':
+            return self.get_state_pixels()
+
+        rend = get_rendering()
         if self.viewer is None:
             self.viewer = rend.Viewer(STATE_W * WINDOW_DISPLAY_SCALE, STATE_H * WINDOW_DISPLAY_SCALE)
             self.boss_ship_transform = rend.Transform(
@@ -252,48 +288,22 @@ class BulletsEnv(gym.Env):
             self.viewer.add_onetime(charging_geom)
 
         # Add bullets to renderer.
-        for bullet in self.bullet_engine.boss_bullets:
+        for bullet_xy in zip(self.bullet_engine.boss_bullets.x, self.bullet_engine.boss_bullets.y):
             bullet_geom = rend.make_circle(radius=1, filled=True)
             bullet_geom.add_attr(
-                    rend.Transform(translation=tuple(np.array([bullet.x, bullet.y]) * WINDOW_DISPLAY_SCALE),
+                    rend.Transform(translation=tuple(np.array(bullet_xy) * WINDOW_DISPLAY_SCALE),
                                    scale=(WINDOW_DISPLAY_SCALE, WINDOW_DISPLAY_SCALE)))
             bullet_geom.set_color(0.8, 0.2, 0)
             self.viewer.add_onetime(bullet_geom)
-        for bullet in self.bullet_engine.player_bullets:
+        for bullet_xy in zip(self.bullet_engine.player_bullets.x, self.bullet_engine.player_bullets.y):
             bullet_geom = rend.make_circle(radius=1, filled=True)
             bullet_geom.add_attr(
-                    rend.Transform(translation=tuple(np.array([bullet.x, bullet.y]) * WINDOW_DISPLAY_SCALE),
+                    rend.Transform(translation=tuple(np.array(bullet_xy) * WINDOW_DISPLAY_SCALE),
                                    scale=(WINDOW_DISPLAY_SCALE, WINDOW_DISPLAY_SCALE)))
             bullet_geom.set_color(0, 0.2, 1.0)
             self.viewer.add_onetime(bullet_geom)
 
-        if mode != 'state_pixels':
-            return self.viewer.render(return_rgb_array=mode == 'rgb_array')
-
-        # Initialize state pixels
-        state_pixels = np.zeros(shape=(STATE_W, STATE_H, 6), dtype=np.int8)
-
-        # Add player ship presence to state
-        ship_xy_data = self.player_ship.get_xy_positions()
-        for xy in ship_xy_data:
-            state_pixels[xy[0]][xy[1]][0] = 1
-
-        # Add boss ship presence to state
-        ship_xy_data = self.boss_ship.get_xy_positions()
-        for xy in ship_xy_data:
-            state_pixels[xy[0]][xy[1]][1] = 1
-
-        # Add player bullet hp to state
-        for bullet in self.bullet_engine.player_bullets:
-            state_pixels[bullet.x][bullet.y][2] = bullet.hp
-            state_pixels[bullet.x][bullet.y][3] = bullet.damage
-
-        # Add boss bullet hp to state
-        for bullet in self.bullet_engine.boss_bullets:
-            state_pixels[bullet.x][bullet.y][4] = bullet.hp
-            state_pixels[bullet.x][bullet.y][5] = bullet.damage
-
-        return state_pixels
+        return self.viewer.render(return_rgb_array=mode == 'rgb_array')
 
     def close(self):
         if self.viewer:
@@ -335,6 +345,109 @@ class Bullet:
         self.steps = 0
 
 
+class Bullets:
+    """
+    All bullets of one side, as a column per bullet attribute (see Bullet) with room for capacity bullets.
+
+    Each column attribute is a view of the live bullets only, in the order they were added, and is replaced whenever
+    bullets are added or removed, so don't hold on to one across those.
+    """
+    COLUMNS = {
+        'x_actual': np.float64,
+        'y_actual': np.float64,
+        'x': np.int64,
+        'y': np.int64,
+        'speed_ratio': np.int64,
+        'damage_ratio': np.float64,
+        'flying_pattern': np.int64,
+        'targetable': np.bool_,
+        'hp': np.int64,
+        'damage': np.int64,
+        'ttl': np.int64,
+        'steps': np.int64,
+    }
+
+    def __init__(self, capacity=256):
+        """
+        :param capacity: Number of bullets to make room for, doubled whenever more are added.
+        :type capacity: int
+        """
+        self.count = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in self.COLUMNS.items()}
+        self.update_views()
+
+    def __len__(self):
+        return self.count
+
+    def update_views(self):
+        for name, column in self.columns.items():
+            setattr(self, name, column[:self.count])
+
+    def add(self, bullets):
+        """
+        :param bullets: Bullets to add after the existing ones.
+        :type bullets: [Bullet]
+        """
+        count = self.count + len(bullets)
+        capacity = len(self.columns['x'])
+        if count > capacity:
+            while capacity < count:
+                capacity = max(1, capacity * 2)
+            for name, column in self.columns.items():
+                self.columns[name] = np.zeros(capacity, dtype=column.dtype)
+                self.columns[name][:self.count] = column[:self.count]
+        for name, column in self.columns.items():
+            column[self.count:count] = [getattr(bullet, name) for bullet in bullets]
+        self.count = count
+        self.update_views()
+
+    def keep(self, mask):
+        """
+        Remove bullets, keeping the order of the rest.
+
+        :param mask: Whether to keep each live bullet.
+        :type mask: np.ndarray
+        """
+        count = int(np.count_nonzero(mask))
+        if count == self.count:
+            return
+        for column in self.columns.values():
+            column[:count] = column[:self.count][mask]
+        self.count = count
+        self.update_views()
+
+    def move(self, y_direction=1):
+        """
+        Remove bullets past TTL, move the rest and remove those out of bounds.
+
+        :param y_direction: Direction bullets fly in.
+        :type y_direction: int
+        """
+        alive = self.steps < self.ttl
+        if (self.flying_pattern[alive] != BulletEngine.FLYING_PATTERN_STRAIGHT).any():
+            quit('Not implemented.')
+
+        # Calculate new x/y.
+        self.steps += 1
+        self.y_actual += y_direction * self.speed_ratio / 20
+        self.y[:] = np.round(self.y_actual)
+
+        # Remove bullets out of bounds.
+        alive &= (self.x >= 0) & (self.x < STATE_W) & (self.y >= 0) & (self.y < STATE_H)
+        self.keep(alive)
+
+    def get_pixel_keys(self):
+        """
+        :return: A key per bullet that is the same for bullets on the same pixel, even out of bounds.
+        :rtype: np.ndarray
+        """
+        return self.x * (1 << 32) + self.y
+
+    def clear(self):
+        self.count = 0
+        self.update_views()
+
+
 class BulletEngine:
     # Simple straight patterns
     FLYING_PATTERN_STRAIGHT_LEFT = 4        # Note left is relative to the straight direction of traveling.
@@ -361,55 +474,70 @@ class BulletEngine:
 
     def __init__(self, player_ship_y_direction=1, boss_ship_y_direction=-1):
         """
-        :type self.player_bullets: [Bullet]
-        :type self.boss_bullets: [Bullet]
+        :type self.player_bullets: Bullets
+        :type self.boss_bullets: Bullets
         """
-        self.player_bullets = []
-        self.boss_bullets = []
+        self.player_bullets = Bullets()
+        self.boss_bullets = Bullets()
         self.player_ship_y_direction = player_ship_y_direction
         self.boss_ship_y_direction = boss_ship_y_direction
 
     @staticmethod
-    def compute_bullet_collisions(bullets_list_a, bullets_list_b):
-        bullets_list_a_remaining = []
-        bullets_list_b_remaining = []
-
-        # Eliminate targetable bullets in list a.
-        for la_b in bullets_list_a:
-            if not la_b.targetable:
-                bullets_list_a_remaining.append(la_b)
-                continue
-
-            # Targetable bullet in list a found.
-            # Iterate against all bullets in list b.
-            for lb_b in bullets_list_b:
-                if lb_b.x == la_b.x and lb_b.y == la_b.y:
-                    # Collision found against bullet in list b.
-                    la_b.hp = la_b.hp - lb_b.damage
-                    lb_b.hp = lb_b.hp - la_b.damage
-
-                    if lb_b.hp > 0:
-                        lb_b.damage = math.ceil(lb_b.hp * lb_b.damage_ratio)
-                        bullets_list_b_remaining.append(lb_b)
-
-                    if la_b.hp <= 0:
-                        # Targetable list a bullet completely destroyed, proceed to next list a bullet.
-                        break
-
-                    # Compute list a bullet's remaining damage.
-                    la_b.damage = math.ceil(la_b.hp * la_b.damage_ratio)
+    def compute_bullet_collisions(bullets_a, bullets_b):
+        """
+        Collide each targetable bullet in a, in order, against the bullets in b on the same pixel, in order.
+        Both sides lose hp by the other's damage, damage is recomputed from what hp is left, and bullets without hp
+        are removed.
+
+        :param bullets_a:
+        :param bullets_b:
+        :type bullets_a: Bullets
+        :type bullets_b: Bullets
+        :return:
+        """
+        if not bullets_a.targetable.any() or len(bullets_b) == 0:
+            return [bullets_a, bullets_b]
+        a_alive = np.ones(len(bullets_a), dtype=bool)
+        b_alive = np.ones(len(bullets_b), dtype=bool)
+
+        # Only targetable bullets in a sharing a pixel with some bullet in b can collide.
+        a_pixels = bullets_a.get_pixel_keys()
+        b_pixels = bullets_b.get_pixel_keys()
+        targets = np.flatnonzero(bullets_a.targetable & np.isin(a_pixels, b_pixels))
+        if len(targets) == 0:
+            return [bullets_a, bullets_b]
+
+        # Hash bullets in b by pixel, in order, for pixels with a target on them.
+        pixel_bullets = {}
+        for j in np.flatnonzero(np.isin(b_pixels, a_pixels[targets])):
+            pixel_bullets.setdefault(b_pixels[j], []).append(j)
+
+        # Eliminate targetable bullets in a.
+        for i in targets:
+            for j in pixel_bullets[a_pixels[i]]:
+                if not b_alive[j]:
+                    continue
+
+                # Collision found against bullet in b.
+                bullets_a.hp[i] -= bullets_b.damage[j]
+                bullets_b.hp[j] -= bullets_a.damage[i]
+
+                if bullets_b.hp[j] > 0:
+                    bullets_b.damage[j] = math.ceil(bullets_b.hp[j] * bullets_b.damage_ratio[j])
                 else:
-                    # No collision, put list b bullet back.
-                    bullets_list_b_remaining.append(lb_b)
+                    b_alive[j] = False
 
-            # List a bullet survived past all collisions.
-            if la_b.hp > 0:
-                bullets_list_a_remaining.append(la_b)
+                if bullets_a.hp[i] <= 0:
+                    # Targetable bullet in a completely destroyed, proceed to next bullet in a.
+                    a_alive[i] = False
+                    break
 
-            # Update list b for iteration against next targetable list a bullet.
-            bullets_list_b = bullets_list_b_remaining
+                # Compute a bullet's remaining damage.
+                bullets_a.damage[i] = math.ceil(bullets_a.hp[i] * bullets_a.damage_ratio[i])
 
-        return [bullets_list_a_remaining, bullets_list_b]
+        bullets_a.keep(a_alive)
+        bullets_b.keep(b_alive)
+        return [bullets_a, bullets_b]
 
     @staticmethod
     def compute_ship_collision(ship, bullets):
@@ -419,63 +547,36 @@ class BulletEngine:
         :param ship:
         :param bullets:
         :type ship: Ship
-        :type bullets: [Bullet]
+        :type bullets: Bullets
         :return:
         """
-        ship_damage = 0
-        bullets_remaining = []
+        # Mark ship pixels on a grid of the screen, then look up each bullet's pixel in it.
         ship_xy_data = ship.get_xy_positions()
-        for bullet in bullets:
-            bullet_hit = False
-            for xy in ship_xy_data:
-                # Collide given ship against given bullets
-                if bullet.x == xy[0] and bullet.y == xy[1]:
-                    ship_damage += bullet.damage
-                    bullet_hit = True
-                    break
-            if not bullet_hit:
-                bullets_remaining.append(bullet)
+        ship_on_screen = ((ship_xy_data[:, 0] >= 0) & (ship_xy_data[:, 0] < STATE_W) &
+                          (ship_xy_data[:, 1] >= 0) & (ship_xy_data[:, 1] < STATE_H))
+        occupancy = np.zeros((STATE_W, STATE_H), dtype=bool)
+        occupancy[ship_xy_data[ship_on_screen, 0], ship_xy_data[ship_on_screen, 1]] = True
+
+        bullet_on_screen = (bullets.x >= 0) & (bullets.x < STATE_W) & (bullets.y >= 0) & (bullets.y < STATE_H)
+        bullet_hit = np.zeros(len(bullets), dtype=bool)
+        bullet_hit[bullet_on_screen] = occupancy[bullets.x[bullet_on_screen], bullets.y[bullet_on_screen]]
+        ship_damage = int(bullets.damage[bullet_hit].sum())
+        bullets.keep(~bullet_hit)
 
-        return [ship_damage, bullets_remaining]
+        return [ship_damage, bullets]
 
     @staticmethod
     def create_bullet(x, y, damage_ratio=1, speed_ratio=10, flying_pattern=FLYING_PATTERN_STRAIGHT, targetable=False,
                       hp=1, ttl=1000):
         return Bullet(x, y, damage_ratio, speed_ratio, flying_pattern, targetable, hp, ttl)
 
-    @staticmethod
-    def get_moved_bullets(bullets_list, y_direction=1):
-        bullets_list_moved = []
-        for bullet in bullets_list:
-            # Remove bullets past TTL.
-            if bullet.steps >= bullet.ttl:
-                continue
-
-            # Calculate new x/y.
-            bullet.steps += 1
-            if bullet.flying_pattern == BulletEngine.FLYING_PATTERN_STRAIGHT:
-                bullet.y_actual += y_direction * bullet.speed_ratio / 20
-                bullet.y = round(bullet.y_actual)
-            else:
-                quit('Not implemented.')
-
-            # Remove bullets out of bounds.
-            if bullet.x < 0 or bullet.x >= STATE_W:
-                continue
-            if bullet.y < 0 or bullet.y >= STATE_H:
-                continue
-
-            bullets_list_moved.append(bullet)
-
-        return bullets_list_moved
-
     def add_player_bullets(self, bullets):
         if len(bullets) > 0:
-            self.player_bullets += bullets
+            self.player_bullets.add(bullets)
 
     def add_boss_bullets(self, bullets):
         if len(bullets) > 0:
-            self.boss_bullets += bullets
+            self.boss_bullets.add(bullets)
 
     def compute_player_ship_collision(self, player_ship):
         [ship_damage, self.boss_bullets] = self.compute_ship_collision(player_ship, self.boss_bullets)
@@ -500,12 +601,12 @@ class BulletEngine:
                                                                                   self.boss_bullets)
 
     def move_bullets(self):
-        self.player_bullets = self.get_moved_bullets(self.player_bullets, self.player_ship_y_direction)
-        self.boss_bullets = self.get_moved_bullets(self.boss_bullets, self.boss_ship_y_direction)
+        self.player_bullets.move(self.player_ship_y_direction)
+        self.boss_bullets.move(self.boss_ship_y_direction)
 
     def reset(self):
-        self.player_bullets = []
-        self.boss_bullets = []
+        self.player_bullets.clear()
+        self.boss_bullets.clear()
 
 
 class Ship:
@@ -609,6 +710,7 @@ class Ship:
         return [[self.x, self.y]]
 
     def get_poly_render(self):
+        rend = get_rendering()
         l, b = math.floor(-self.ship_width / 2), math.floor(-self.ship_height / 2)
         r, t = l + self.ship_width, b + self.ship_height
         poly = rend.FilledPolygon([(l, b), (l, t), (r, t), (r, b)])
@@ -646,6 +748,7 @@ class PlayerShip(Ship):
         self.shield_duration = 0
 
     def get_poly_render(self, scale=1):
+        rend = get_rendering()
         xy_line = [(-3.5, -1), (0, 2.5), (3.5, -1),
                    (2.5, -2.5), (1.5, -2.5), (1.5, -1.5),
                    (0.5, -1.5), (0.5, -2.5), (-0.5, -2.5), (-0.5, -1.5),
@@ -822,6 +925,7 @@ class BossShipSkullyTrident(Ship):
         super().reset()
 
     def get_poly_render(self, scale=1):
+        rend = get_rendering()
         xy = [(0, 5), (-3, 5), (-4, 4), (-4, 2), (-3, 1), (-5, 0), (-5, -3), (-4, -4), (-3, -3), (-2, 0), (-1, -4),
               (0, -5), (1, -4), (2, 0), (3, -3), (4, -4), (5, -3), (5, 0), (3, 1), (4, 2), (4, 4), (3, 5)]
         xy = np.array(xy, dtype=np.float)
@@ -889,6 +993,7 @@ class BossShipSkullyTridentLarge(Ship):
         super().reset()
 
     def get_poly_render(self, scale=1):
+        rend = get_rendering()
         xy = [(0, 5), (-3, 5), (-4, 4), (-4, 2), (-3, 1), (-5, 0), (-5, -3), (-4, -4), (-3, -3), (-2, 0), (-1, -4),
               (0, -5), (1, -4), (2, 0), (3, -3), (4, -4), (5, -3), (5, 0), (3, 1), (4, 2), (4, 4), (3, 5)]
         xy = np.array(xy, dtype=np.int8)
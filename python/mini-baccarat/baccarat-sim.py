@@ -1,15 +1,140 @@
-from pandas import DataFrame
+import argparse
+import json
+import numpy as np
+import os
+import platform
+import struct
+import sys
+import tempfile
+import threading
+import time
+import timeit
+from datetime import datetime
+from fractions import Fraction
+from functools import lru_cache
+from multiprocessing import Manager, Pool, cpu_count
+from pandas import DataFrame, MultiIndex
 from random import SystemRandom
+from statistics import NormalDist
 
+try:
+    import resource
+except ImportError:
+    resource = None
 
-def prepare_cards(num_decks=8):
+# Results as integer codes, RESULTS[code] gives the letter used by play_game.
+PLAYER = 0
+BANK = 1
+TIE = 2
+NO_RESULT = -1
+SHOE_END = 3
+RESULTS = 'PBT'
+RESULT_CODES = {'P': PLAYER, 'B': BANK, 'T': TIE}
+
+# Point values of cards, indexed by card.
+CARD_POINTS = (0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 0, 0, 0, 0)
+CARD_POINTS_ARRAY = np.array(CARD_POINTS, dtype=np.int64)
+
+# Whether bank draws a 3rd card, indexed by [bank_points][player_3rd_card_points].
+# Only used when player drew, if player stands bank draws on 5 or less.
+BANK_DRAWS = np.array([
+    [True] * 10,
+    [True] * 10,
+    [True] * 10,
+    [i != 8 for i in range(10)],
+    [2 <= i <= 7 for i in range(10)],
+    [4 <= i <= 7 for i in range(10)],
+    [6 <= i <= 7 for i in range(10)],
+    [False] * 10,
+    [False] * 10,
+    [False] * 10,
+])
+BANK_DRAWS_LIST = BANK_DRAWS.tolist()
+
+# Where the table of game outcomes is cached, see outcome_table.
+OUTCOME_TABLE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'mini-baccarat', 'outcome-table-v1.npy')
+
+# Result and number of cards used by each outcome in the outcome table.
+OUTCOME_RESULTS = tuple(i % 3 for i in range(9))
+CARDS_USED = tuple(4 + i // 3 for i in range(9))
+
+# Weights of the next 6 cards in an outcome table index, last card first.
+OUTCOME_INDEX_WEIGHTS = 10 ** np.arange(6)
+
+# Payouts per unit bet on a win, player and bank bets push on a tie.
+# Ties pay 7 to 1, the payout WIN_RATIO_THRESHOLDS were worked out with,
+# so bet_evs, backtest and signature_stats agree on what an edge is.
+PLAYER_PAYOUT = 1
+BANK_PAYOUT = 0.95
+TIE_PAYOUT = 7
+
+# Units won per unit bet, by bet and result, ties push player and bank bets.
+# The last row is for NO_RESULT, not betting.
+BET_PROFITS = np.array([
+    [PLAYER_PAYOUT, -1, 0],
+    [-1, BANK_PAYOUT, 0],
+    [-1, -1, TIE_PAYOUT],
+    [0, 0, 0],
+])
+
+# Win ratios in percent of player, bank and tie worth betting on, you can win
+# at least $1.6 from player or tie on betting $100, with tie paying TIE_PAYOUT.
+WIN_RATIO_THRESHOLDS = (50.8, 53, 12.7)
+
+# Min number of games played for a signature to be analyzed.
+MIN_PLAYED = 50000
+
+# Recordings of results, see OutcomeRecorder.
+RECORDING_MAGIC = b'PBT1'
+RECORDING_HEADER = struct.Struct('<4sQ')
+UNPACKED_BYTES = (np.arange(256, dtype=np.uint8)[:, None] >> np.array([0, 2, 4, 6], dtype=np.uint8)) & 3
+
+
+def make_rng(seed=None):
+    """
+    Make random number generator for shuffling.
+
+    :param seed: Seed or numpy SeedSequence for fast reproducible runs, None
+                 to use SystemRandom for audit runs.
+    :return: SystemRandom or numpy Generator.
+    """
+    if seed is None:
+        return SystemRandom()
+    return np.random.default_rng(seed)
+
+
+def shuffle_swaps(rng, num_shoes, total_cards):
+    """
+    Draw Fisher-Yates swap positions, column i holds a position within [0, i].
+
+    Python RNGs get all bits in a single getrandbits call, which is a single
+    syscall for SystemRandom. Positions are then taken modulo i + 1 of 64 bit
+    numbers, the bias of which is below 2^-55.
+
+    :param rng: SystemRandom, random.Random or numpy Generator.
+    :param int num_shoes: Number of shoes to shuffle.
+    :param int total_cards: Number of cards per shoe.
+    :return: 2D array of swap positions, one row per shoe.
+    """
+    bounds = np.arange(1, total_cards + 1, dtype=np.uint64)
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(0, bounds, size=(num_shoes, total_cards), dtype=np.uint64)
+
+    num_bits = 64 * num_shoes * total_cards
+    bits = rng.getrandbits(num_bits).to_bytes(num_bits // 8, 'little')
+    return np.frombuffer(bits, dtype=np.uint64).reshape(num_shoes, total_cards) % bounds
+
+
+def prepare_cards(num_decks=8, rng=None):
     """
     Prepare decks
 
+    :param int num_decks: Number of decks to use.
+    :param rng: SystemRandom, random.Random or numpy Generator, defaults to SystemRandom.
     :return: List of shuffled cards as integers, J, Q, K are represented by
              11, 12, 13, respectively.
     """
-    sys_rand = SystemRandom()
+    rng = rng or SystemRandom()
 
     # Init 8 decks
     cards = [i for i in range(1, 14)]
@@ -17,11 +142,105 @@ def prepare_cards(num_decks=8):
     total_cards = 13 * 4 * num_decks
 
     # Shuffle cards
-    shuffle_order = [sys_rand.randrange(0, total_cards - i) for i in range(total_cards)]
-    cards_shuffled = [cards.pop(pos) for pos in shuffle_order]
+    if isinstance(rng, np.random.Generator):
+        return rng.permutation(cards).tolist()
+
+    swaps = shuffle_swaps(rng, 1, total_cards)[0].tolist()
+    for i in range(total_cards - 1, 0, -1):
+        j = swaps[i]
+        cards[i], cards[j] = cards[j], cards[i]
 
     # Get them out
-    return cards_shuffled
+    return cards
+
+
+def prepare_shoes(num_shoes, num_decks=8, rng=None):
+    """
+    Prepare many shuffled shoes at once.
+
+    :param int num_shoes: Number of shoes to prepare.
+    :param int num_decks: Number of decks per shoe.
+    :param rng: SystemRandom, random.Random or numpy Generator, defaults to SystemRandom.
+    :return: 2D int8 array of cards as in prepare_cards, one shoe per row.
+    """
+    rng = rng or SystemRandom()
+
+    total_cards = 13 * 4 * num_decks
+    shoes = np.tile(np.arange(1, 14, dtype=np.int8), (num_shoes, 4 * num_decks))
+    if isinstance(rng, np.random.Generator):
+        return rng.permuted(shoes, axis=1)
+
+    # Fisher-Yates on all shoes at once, one swap per card position.
+    swaps = shuffle_swaps(rng, num_shoes, total_cards).astype(np.intp)
+    rows = np.arange(num_shoes)
+    for i in range(total_cards - 1, 0, -1):
+        j = swaps[:, i]
+        swapped = shoes[rows, j]
+        shoes[rows, j] = shoes[:, i]
+        shoes[:, i] = swapped
+
+    return shoes
+
+
+def resolve_draws(draws):
+    """
+    Resolve games by the rules from the point values of the next 6 cards.
+
+    :param numpy.ndarray draws: 2D array of card point values, one game per
+                                row, in the order cards are dealt.
+    :return: Tuple of arrays, results as PLAYER, BANK or TIE, and number of
+             cards used.
+    """
+    player_points = (draws[:, 0] + draws[:, 2]) % 10
+    bank_points = (draws[:, 1] + draws[:, 3]) % 10
+
+    # Naturals (8 or 9) get evaluated immediately
+    natural = (player_points >= 8) | (bank_points >= 8)
+
+    # Player draws on 5 or less and stands on 6 or 7. Bank draws depending on
+    # player's 3rd card, or on 5 or less if player stands.
+    player_draw = ~natural & (player_points <= 5)
+    third_card = np.where(player_draw, draws[:, 4], 0)
+    bank_draw = ~natural & np.where(player_draw, BANK_DRAWS[bank_points, third_card], bank_points <= 5)
+    player_points = (player_points + third_card) % 10
+
+    # Bank's 3rd card is the 5th or 6th card depending on whether player drew.
+    bank_card = np.where(player_draw, draws[:, 5], draws[:, 4])
+    bank_points = np.where(bank_draw, (bank_points + bank_card) % 10, bank_points)
+
+    results = np.full(len(draws), TIE, dtype=np.int8)
+    results[player_points > bank_points] = PLAYER
+    results[bank_points > player_points] = BANK
+    return results, 4 + player_draw + bank_draw
+
+
+@lru_cache(maxsize=None)
+def outcome_table():
+    """
+    Get table of game outcomes indexed by the point values of the next 6
+    cards as a base 10 number, first card dealt being the highest digit.
+
+    Each outcome is result + 3 * (cards used - 4). The table is built once
+    and cached in OUTCOME_TABLE_PATH.
+
+    :return: Table as bytes, one outcome per byte.
+    """
+    if os.path.exists(OUTCOME_TABLE_PATH):
+        table = np.load(OUTCOME_TABLE_PATH)
+        if table.shape == (10 ** 6,):
+            return table.tobytes()
+
+    draws = np.indices((10,) * 6, dtype=np.int8).reshape(6, -1).T
+    results, cards_used = resolve_draws(draws)
+    table = (results + 3 * (cards_used - 4)).astype(np.int8)
+
+    # Save next to the final path first, so another process never loads a partial table.
+    os.makedirs(os.path.dirname(OUTCOME_TABLE_PATH), exist_ok=True)
+    tmp_path = '%s.%d.tmp' % (OUTCOME_TABLE_PATH, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        np.save(f, table)
+    os.replace(tmp_path, OUTCOME_TABLE_PATH)
+    return table.tobytes()
 
 
 def play_game(cards, num_cards_to_discard=0):
@@ -29,165 +248,2234 @@ def play_game(cards, num_cards_to_discard=0):
     Play mini-baccarat game according to the rules, and return string as
     'P', 'B', or 'T' depending on who the winner is.
 
-    :param list cards:
-    :param int num_cards_to_discard:
+    :param cards: List of cards, dealt from the end, or Shoe.
+    :param int num_cards_to_discard: Number of cards to burn before dealing.
     :return: String 'P' if player wins, 'B' if bank wins, or 'T' for tie.
     """
+    if isinstance(cards, Shoe):
+        return RESULTS[cards.play_game(num_cards_to_discard)]
+
+    # Burn cards off the end of the shoe.
     if num_cards_to_discard:
-        cards = cards[num_cards_to_discard:]
-
-    card = cards.pop()
-    player_points = card if card < 10 else 0
-    card = cards.pop()
-    bank_points = card if card < 10 else 0
-    card = cards.pop()
-    player_points = (card if card < 10 else 0) + player_points
-    if player_points >= 10:
-        player_points -= 10
-    card = cards.pop()
-    bank_points = (card if card < 10 else 0) + bank_points
-    if bank_points >= 10:
-        bank_points -= 10
+        del cards[-num_cards_to_discard:]
 
-    # Naturals (8 or 9) get evaluated immediately
-    if player_points >= 8 or bank_points >= 8:
-        if player_points > bank_points:
-            return 'P'
-        if bank_points > player_points:
-            return 'B'
-        return 'T'
+    # Look up the next 6 cards, missing cards at the end of the shoe are never used.
+    if len(cards) >= 6:
+        index = (CARD_POINTS[cards[-1]] * 100000 + CARD_POINTS[cards[-2]] * 10000 + CARD_POINTS[cards[-3]] * 1000
+                 + CARD_POINTS[cards[-4]] * 100 + CARD_POINTS[cards[-5]] * 10 + CARD_POINTS[cards[-6]])
+    else:
+        index = 0
+        for card in cards[::-1]:
+            index = index * 10 + CARD_POINTS[card]
+        index *= 10 ** (6 - len(cards))
 
-    # By default bank does not draw a 3rd card.
-    bank_draw = False
+    outcome = outcome_table()[index]
+    cards_used = CARDS_USED[outcome]
+    if cards_used > len(cards):
+        raise IndexError('Not enough cards left to play a game.')
+    del cards[-cards_used:]
+
+    return RESULTS[OUTCOME_RESULTS[outcome]]
+
+
+class Shoe:
+    """
+    Shoe of shuffled cards dealt from the end of a fixed array by moving a
+    cursor, so dealing, burning and playing games never copy cards.
+
+    Outcomes of games starting at every position in the shoe are looked up
+    from the outcome table on shuffle, so each game is a single read.
+    """
+
+    def __init__(self, num_decks=8, decks_discarded=2, rng=None, cut_card=None, cards=None):
+        """
+        :param int num_decks: Number of decks in shoe.
+        :param int decks_discarded: Number of decks to cut, at which time reshuffle will happen.
+        :param rng: SystemRandom, random.Random or numpy Generator, defaults to SystemRandom.
+        :param int cut_card: Number of cards behind the cut card, overrides decks_discarded.
+        :param list cards: Cards to load instead of shuffling, dealt from the end.
+        """
+        self.num_decks = num_decks
+        self.rng = rng or SystemRandom()
+        self.cut = max(decks_discarded * 13 * 4 if cut_card is None else cut_card, 5)
+        self.cards = None
+        self.outcomes = None
+        self.cursor = 0
+        if cards is None:
+            self.shuffle()
+        else:
+            self.load(cards)
+
+    def shuffle(self):
+        """
+        Shuffle a fresh shoe.
+        """
+        if isinstance(self.rng, np.random.Generator):
+            self.load(self.rng.permutation(np.tile(np.arange(1, 14, dtype=np.int8), 4 * self.num_decks)))
+        else:
+            self.load(prepare_cards(self.num_decks, self.rng))
+
+    def load(self, cards):
+        """
+        Put cards in the shoe, the last card is dealt first.
+
+        :param cards: Cards as integers, J, Q, K as 11, 12, 13.
+        """
+        self.cards = np.array(cards, dtype=np.int8)
+        self.cursor = len(self.cards)
+
+        # Outcome of the next game when `cursor` cards are left is outcomes[cursor],
+        # cards past the start of the shoe are never used so they count as 0.
+        points = CARD_POINTS_ARRAY[np.concatenate((np.zeros(6, dtype=np.int8), self.cards))]
+        indices = np.correlate(points, OUTCOME_INDEX_WEIGHTS, 'valid')
+        self.outcomes = np.frombuffer(outcome_table(), dtype=np.int8)[indices].tobytes()
+
+    def __len__(self):
+        return self.cursor
+
+    @property
+    def needs_shuffle(self):
+        """
+        :return: Whether the cut card has been reached.
+        """
+        return self.cursor <= self.cut
+
+    def remaining(self):
+        """
+        :return: List of cards left, the last card is dealt next.
+        """
+        return self.cards[:self.cursor].tolist()
+
+    def deal(self):
+        """
+        :return: Next card.
+        """
+        if not self.cursor:
+            raise IndexError('No cards left in shoe.')
+        self.cursor -= 1
+        return int(self.cards[self.cursor])
+
+    def burn(self, num_cards=1):
+        """
+        Discard cards without playing them.
+
+        :param int num_cards: Number of cards to burn.
+        """
+        self.cursor = max(self.cursor - num_cards, 0)
+
+    def play_game(self, num_cards_to_discard=0):
+        """
+        Play mini-baccarat game according to the rules.
+
+        :param int num_cards_to_discard: Number of cards to burn before dealing.
+        :return: PLAYER, BANK or TIE.
+        """
+        self.burn(num_cards_to_discard)
+        outcome = self.outcomes[self.cursor]
+        if CARDS_USED[outcome] > self.cursor:
+            raise IndexError('Not enough cards left to play a game.')
+        self.cursor -= CARDS_USED[outcome]
+        return OUTCOME_RESULTS[outcome]
+
+    def play(self, max_games=None, num_cards_to_discard=0):
+        """
+        Play games until the cut card is reached.
+
+        :param int max_games: Max number of games to play, None to play until the cut card.
+        :param int num_cards_to_discard: Number of cards to burn before dealing each game.
+        :return: List of results as PLAYER, BANK or TIE.
+        """
+        if max_games is None:
+            max_games = self.cursor
+
+        outcomes = self.outcomes
+        cursor = self.cursor
+        cut = self.cut
+        results = []
+        append = results.append
+        while cursor > cut and max_games:
+            max_games -= 1
+            cursor -= num_cards_to_discard
+            if cursor < 6 and (cursor < 4 or CARDS_USED[outcomes[cursor]] > cursor):
+                # Burnt into the last cards of the shoe.
+                cursor = max(cursor, 0)
+                break
+            outcome = outcomes[cursor]
+            cursor -= CARDS_USED[outcome]
+            append(OUTCOME_RESULTS[outcome])
+
+        self.cursor = cursor
+        return results
+
+    def cursors(self, cursor, num_games, num_cards_to_discard=0):
+        """
+        Work out the number of cards left before dealing each game played by play.
+
+        :param int cursor: Number of cards left before play.
+        :param int num_games: Number of games played.
+        :param int num_cards_to_discard: Number of cards burnt before dealing each game.
+        :return: List of cards left, one per game.
+        """
+        cursors = []
+        for _ in range(num_games):
+            cursor -= num_cards_to_discard
+            cursors.append(cursor)
+            cursor -= CARDS_USED[self.outcomes[cursor]]
+        return cursors
+
+    def odds(self, cursor, num_games, num_cards_to_discard=0):
+        """
+        Work out exact odds of games played by play, from the cards left
+        before each of them.
+
+        Games dealt from fewer than 6 cards, burnt into the last cards of the
+        shoe, have no odds of their own. Their odds are their results instead,
+        so they add nothing to control variates.
+
+        :param int cursor: Number of cards left before play.
+        :param int num_games: Number of games played.
+        :param int num_cards_to_discard: Number of cards burnt before dealing each game.
+        :return: 2D array of odds of player win, bank win and tie, one row per game.
+        """
+        cursors = np.array(self.cursors(cursor, num_games, num_cards_to_discard), dtype=np.int64)
+        points = CARD_POINTS_ARRAY[self.cards]
+        counts = np.zeros((len(points) + 1, 10), dtype=np.int64)
+        counts[1:] = np.cumsum(points[:, None] == np.arange(10), axis=0)
+        short = cursors < 6
+        odds = np.zeros((len(cursors), 3))
+        odds[~short] = shoe_odds(counts[cursors[~short]])
+        odds[np.flatnonzero(short), [OUTCOME_RESULTS[self.outcomes[c]] for c in cursors[short]]] = 1
+        return odds
+
+
+def play_game_batch(points, remaining, rows):
+    """
+    Play one mini-baccarat game in each of the given shoes at once.
+
+    Cards are dealt from the end of each row, same as play_game does with
+    cards.pop(), so both return the same results on the same cards.
+
+    :param numpy.ndarray points: 2D array of card point values, one shoe per row.
+    :param numpy.ndarray remaining: Number of cards left in each shoe, updated in place.
+    :param numpy.ndarray rows: Indices of the shoes to play.
+    :return: Array of PLAYER, BANK or TIE, one per row played.
+    """
+    left = remaining[rows]
+    index = np.zeros(len(rows), dtype=np.int64)
+    for i in range(1, 7):
+        # Cards past the start of the shoe are never used.
+        index = index * 10 + np.where(left >= i, points[rows, np.maximum(left - i, 0)], 0)
+
+    outcomes = np.frombuffer(outcome_table(), dtype=np.int8)[index]
+    remaining[rows] = left - 4 - outcomes // 3
+    return outcomes % 3
 
-    # Player stands on 6 or 7
-    if player_points >= 6:
-        if bank_points <= 5:
-            # Bank will draw on 5 or less if player stands.
-            bank_draw = True
-    else:
-        # Player draws
-        card = cards.pop()
-        player_points = (card if card < 10 else 0) + player_points
-        if player_points > 10:
-            player_points -= 10
-
-        if bank_points < 3:
-            # Bank will always draw on 0, 1, 2
-            bank_draw = True
-        elif bank_points == 7:
-            bank_draw = False
-        elif bank_points == 3:
-            bank_draw = card != 8
-        elif bank_points == 4:
-            bank_draw = card in [2, 3, 4, 5, 6, 7]
-        elif bank_points == 5:
-            bank_draw = card in [4, 5, 6, 7]
-        elif bank_points == 6:
-            bank_draw = card in [6, 7]
-
-    if bank_draw:
-        card = cards.pop()
-        bank_points = (card if card < 10 else 0) + bank_points
-        if bank_points >= 10:
-            bank_points -= 10
 
+def play_shoes_batch(shoes, decks_discarded=2):
+    """
+    Play all games of many shoes at once, each shoe until its cut card is reached.
+
+    :param numpy.ndarray shoes: 2D array of cards as from prepare_cards, one shoe per row.
+    :param int decks_discarded: Number of decks to cut, at which time reshuffle will happen.
+    :return: 2D int8 array of results per shoe in order of play, padded with NO_RESULT.
+    """
+    shoes = np.asarray(shoes)
+    num_shoes, num_cards = shoes.shape
+    points = np.where(shoes < 10, shoes, 0).astype(np.int8)
+    remaining = np.full(num_shoes, num_cards, dtype=np.intp)
+    cut = max(decks_discarded * 13 * 4, 5)
+
+    # Each game uses at least 4 cards.
+    max_games = max((num_cards - cut) // 4 + 1, 0)
+    results = np.full((num_shoes, max_games), NO_RESULT, dtype=np.int8)
+
+    game = 0
+    rows = np.flatnonzero(remaining > cut)
+    while len(rows):
+        results[rows, game] = play_game_batch(points, remaining, rows)
+        game += 1
+        rows = rows[remaining[rows] > cut]
+
+    return results
+
+
+def shoe_counts(num_decks=8):
+    """
+    Count cards of a full shoe per point value.
+
+    :param int num_decks: Number of decks in shoe.
+    :return: Tuple of card counts indexed by point value 0 to 9, 10, J, Q, K
+             all being worth 0.
+    """
+    return (16 * num_decks,) + (4 * num_decks,) * 9
+
+
+def card_counts(cards):
+    """
+    Count cards per point value.
+
+    :param cards: Cards as integers, J, Q, K as 11, 12, 13.
+    :return: Tuple of card counts indexed by point value.
+    """
+    counts = [0] * 10
+    for card in cards:
+        counts[card if card < 10 else 0] += 1
+    return tuple(counts)
+
+
+def compare_points(player_points, bank_points):
+    """
+    :return: PLAYER, BANK or TIE, whoever has more points.
+    """
     if player_points > bank_points:
-        return 'P'
+        return PLAYER
     if bank_points > player_points:
-        return 'B'
-    return 'T'
+        return BANK
+    return TIE
 
 
-def play_games(num_games, num_decks_in_shoe=8, decks_discarded=2, num_cards_to_discard=0, results_to_track_min=5, results_to_track_max=8):
+@lru_cache(maxsize=1 << 20)
+def third_card_ways(counts, player_points, bank_points):
     """
-    Play multiple games and print statistics.
+    Count ways 3rd cards can fall for a non-natural hand, same as in play_game.
+
+    Every way is an ordered draw of the next 2 cards from counts whether they
+    are dealt or not, so the ways always add up to n * (n - 1) for n cards.
+
+    :param tuple counts: Cards left per point value.
+    :param int player_points: Player points of the first 2 cards.
+    :param int bank_points: Bank points of the first 2 cards.
+    :return: List of ways for player win, bank win and tie.
+    """
+    n = sum(counts)
+    ways = [0, 0, 0]
+
+    # Player stands on 6 or 7, bank draws on 5 or less.
+    if player_points >= 6:
+        if bank_points <= 5:
+            for card, k in enumerate(counts):
+                ways[compare_points(player_points, (bank_points + card) % 10)] += k * (n - 1)
+        else:
+            ways[compare_points(player_points, bank_points)] += n * (n - 1)
+        return ways
+
+    # Player draws, bank draws depending on player's 3rd card.
+    for card, k in enumerate(counts):
+        if not k:
+            continue
+        points = (player_points + card) % 10
+        if BANK_DRAWS_LIST[bank_points][card]:
+            for bank_card, bank_k in enumerate(counts):
+                bank_k -= bank_card == card
+                ways[compare_points(points, (bank_points + bank_card) % 10)] += k * bank_k
+        else:
+            ways[compare_points(points, bank_points)] += k * (n - 1)
+    return ways
+
+
+@lru_cache(maxsize=1 << 16)
+def exact_odds(counts):
+    """
+    Work out exact odds of the next game from the cards left in the shoe.
+
+    Goes through every ordered draw of the 6 cards a game can use, weighted by
+    how many ways each can be drawn from counts without replacement. Hands
+    after the first 4 cards are memoized on the cards left, so a full 8 deck
+    shoe takes well under a second.
+
+    :param tuple counts: Cards left per point value, as from shoe_counts.
+    :return: Tuple of Fractions, odds of player win, bank win and tie.
+    """
+    counts = list(counts)
+    n = sum(counts)
+    if n < 6:
+        raise ValueError('Need at least 6 cards to play a game, got %d.' % n)
+
+    ways = [0, 0, 0]
+    rest = (n - 4) * (n - 5)
+    for p1 in range(10):
+        k1 = counts[p1]
+        if not k1:
+            continue
+        counts[p1] -= 1
+        for b1 in range(10):
+            k2 = counts[b1]
+            if not k2:
+                continue
+            counts[b1] -= 1
+            for p2 in range(10):
+                k3 = counts[p2]
+                if not k3:
+                    continue
+                counts[p2] -= 1
+                player_points = (p1 + p2) % 10
+                for b2 in range(10):
+                    k4 = counts[b2]
+                    if not k4:
+                        continue
+                    weight = k1 * k2 * k3 * k4
+                    bank_points = (b1 + b2) % 10
+
+                    # Naturals (8 or 9) get evaluated immediately
+                    if player_points >= 8 or bank_points >= 8:
+                        ways[compare_points(player_points, bank_points)] += weight * rest
+                        continue
+
+                    counts[b2] -= 1
+                    player_ways, bank_ways, tie_ways = third_card_ways(tuple(counts), player_points, bank_points)
+                    counts[b2] += 1
+                    ways[PLAYER] += weight * player_ways
+                    ways[BANK] += weight * bank_ways
+                    ways[TIE] += weight * tie_ways
+                counts[p2] += 1
+            counts[b1] += 1
+        counts[p1] += 1
+
+    total = n * (n - 1) * (n - 2) * (n - 3) * rest
+    return tuple(Fraction(w, total) for w in ways)
+
+
+def bet_evs(odds):
+    """
+    Expected value per unit of each bet, ties push player and bank bets.
+
+    :param tuple odds: Odds of player win, bank win and tie.
+    :return: Tuple of EVs for player, bank and tie bets.
+    """
+    player_odds, bank_odds, tie_odds = (float(o) for o in odds)
+    return (
+        player_odds * PLAYER_PAYOUT - bank_odds,
+        bank_odds * BANK_PAYOUT - player_odds,
+        tie_odds * TIE_PAYOUT - player_odds - bank_odds,
+    )
+
+
+@lru_cache(maxsize=None)
+def draw_outcomes():
+    """
+    Count results of every ordered draw of 6 card point values, grouped by
+    how many of each point value were drawn.
+
+    The odds of drawing a given ordered 6 cards only depend on how many of
+    each point value are in them, so grouping turns 10^6 draws into 5005.
+
+    :return: Tuple of 2D arrays (multiplicities, ways). Both have one row per
+             group, multiplicities of each point value and ways for player
+             win, bank win and tie respectively.
+    """
+    draws = np.indices((10,) * 6, dtype=np.int8).reshape(6, -1).T
+    results = np.frombuffer(outcome_table(), dtype=np.int8) % 3
+
+    multiplicities = (draws[:, :, None] == np.arange(10, dtype=np.int8)).sum(axis=1)
+    keys = multiplicities.astype(np.int64) @ 7 ** np.arange(10, dtype=np.int64)
+    keys, first, groups = np.unique(keys, return_index=True, return_inverse=True)
+    ways = np.zeros((len(keys), 3), dtype=np.int64)
+    np.add.at(ways, (groups, results), 1)
+    return multiplicities[first], ways
+
+
+@lru_cache(maxsize=None)
+def odds_blocks():
+    """
+    Split draw_outcomes groups by how many of the 6 cards are low (0-4) and
+    high (5-9) point values, so weights of groups factor into weights of the
+    low and high cards drawn.
+
+    :return: Tuple of blocks, one per number of low cards. Each block is a
+             tuple (low, high, ways) of flat indices into falling factorials
+             of the low and high multiplicities, and ways by
+             [low multiplicities, result, high multiplicities].
+    """
+    multiplicities, ways = draw_outcomes()
+    num_low = multiplicities[:, :5].sum(axis=1)
+    blocks = []
+    for num in range(7):
+        block = num_low == num
+        low_keys, low_first, low_groups = np.unique(multiplicities[block, :5] @ 7 ** np.arange(5), return_index=True,
+                                                    return_inverse=True)
+        high_keys, high_first, high_groups = np.unique(multiplicities[block, 5:] @ 7 ** np.arange(5),
+                                                       return_index=True, return_inverse=True)
+        block_ways = np.zeros((len(low_keys), 3, len(high_keys)))
+        for result in (PLAYER, BANK, TIE):
+            block_ways[low_groups, result, high_groups] = ways[block, result]
+        blocks.append((
+            np.arange(5) * 7 + multiplicities[block, :5][low_first],
+            np.arange(5, 10) * 7 + multiplicities[block, 5:][high_first],
+            block_ways,
+        ))
+    return tuple(blocks)
+
+
+def shoe_odds(counts):
+    """
+    Work out odds of the next game from the cards left, same as exact_odds
+    but in floating point and in microseconds.
+
+    :param counts: Cards left per point value, as from shoe_counts, or a 2D
+                   array of them to work out the odds of many shoes at once.
+    :return: Array of odds of player win, bank win and tie, one row per shoe for 2D counts.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    shoes = counts.reshape(-1, 10)
+    n = shoes.sum(axis=1)
+    if len(n) and n.min() < 6:
+        raise ValueError('Need at least 6 cards to play a game, got %d.' % n.min())
+
+    # Falling factorials of each count, ways to draw j cards of a point value in order.
+    falling = np.ones((len(shoes), 10, 7))
+    for j in range(1, 7):
+        falling[:, :, j] = falling[:, :, j - 1] * (shoes - j + 1)
+    falling = falling.reshape(len(shoes), 70)
+
+    odds = np.zeros((len(shoes), 3))
+    for low, high, ways in odds_blocks():
+        low_weights = falling[:, low].prod(axis=2)
+        high_weights = falling[:, high].prod(axis=2)
+        low_ways = (low_weights @ ways.reshape(len(ways), -1)).reshape(len(shoes), 3, -1)
+        odds += (low_ways @ high_weights[:, :, None])[:, :, 0]
+    odds /= (n * (n - 1) * (n - 2) * (n - 3) * (n - 4) * (n - 5))[:, None]
+    return odds.reshape(counts.shape[:-1] + (3,))
+
+
+class LiveShoe:
+    """
+    Follow a shoe as its cards are dealt, keeping odds and bet EVs of the next
+    game up to date.
+
+    Games are resolved from the shared draw_outcomes groups, so each update
+    only re-weights them by the cards left instead of solving from scratch.
+    """
+
+    def __init__(self, num_decks=8):
+        self.num_decks = num_decks
+        self.counts = None
+        self.odds = None
+        self.evs = None
+        self.reset()
+
+    def reset(self, cards=None):
+        """
+        Start a fresh shoe.
+
+        :param list cards: Cards in shoe, defaults to a full shoe of num_decks.
+        """
+        counts = shoe_counts(self.num_decks) if cards is None else card_counts(cards)
+        self.counts = np.array(counts, dtype=np.int64)
+        self.update()
+
+    def deal(self, card):
+        """
+        Take a dealt card out of the shoe.
+
+        :param int card: Card as integer, J, Q, K as 11, 12, 13.
+        """
+        self.counts[card if card < 10 else 0] -= 1
+
+    def update(self):
+        """
+        Work out odds and EVs of the next game.
+
+        With fewer than 6 cards left there may not be a next game, so odds
+        and EVs are left as None.
+
+        :return: Tuple of EVs for player, bank and tie bets, or None.
+        """
+        if self.counts.sum() < 6:
+            self.odds = None
+            self.evs = None
+        else:
+            self.odds = shoe_odds(self.counts)
+            self.evs = bet_evs(self.odds)
+        return self.evs
+
+    def deal_game(self, cards):
+        """
+        Take all cards of a game out of the shoe and update for the next game.
+
+        :param cards: Cards dealt in the game.
+        :return: Tuple of EVs for player, bank and tie bets, or None with fewer than 6 cards left.
+        """
+        for card in cards:
+            self.deal(card)
+        return self.update()
+
+    @property
+    def best_bet(self):
+        """
+        :return: Tuple of best bet as 'P', 'B' or 'T', and its EV.
+        """
+        bet = int(np.argmax(self.evs))
+        return RESULTS[bet], self.evs[bet]
+
+
+def find_edges(cards, decks_discarded=2, min_ev=0.0):
+    """
+    Play through a shoe and find games where a bet has an edge over the house.
+
+    :param list cards: Shoe as from prepare_cards, consumed while playing.
+    :param int decks_discarded: Number of decks to cut, at which time reshuffle will happen.
+    :param float min_ev: Min EV per unit bet to count as an edge.
+    :return: List of tuples (game number, bet, EV, result) for games with an edge.
+    """
+    live_shoe = LiveShoe()
+    live_shoe.reset(cards)
+    edges = []
+    game = 0
+    while len(cards) > max(decks_discarded * 13 * 4, 5):
+        bet, ev = live_shoe.best_bet
+        num_cards = len(cards)
+        next_cards = cards[-6:]
+        result = play_game(cards)
+        if ev > min_ev:
+            edges.append((game, bet, ev, result))
+
+        # play_game pops dealt cards off the end.
+        live_shoe.deal_game(next_cards[6 - (num_cards - len(cards)):])
+        game += 1
+    return edges
+
+
+def new_counters(results_to_track_min=5, results_to_track_max=8):
+    """
+    Make empty result signature counters.
+
+    A signature of length n is the base 3 code of the last n results, oldest
+    result first, e.g. 'PBT' is 0 * 9 + 1 * 3 + 2. Counters for each length
+    are an array of player wins, bank wins and ties indexed by
+    [code, result], games played for a signature being the sum of its row.
+
+    :param int results_to_track_min: Min length of results to track.
+    :param int results_to_track_max: Max length of results to track.
+    :return: Dict of counter arrays keyed by signature length.
+    """
+    return {n: np.zeros((3 ** n, 3), dtype=np.int64) for n in range(results_to_track_min, results_to_track_max + 1)}
+
+
+def merge_counters(counters, other):
+    """
+    Add result signature counters from another run into counters.
+
+    :param dict counters: Counters to add to, as from new_counters.
+    :param dict other: Counters to add.
+    :return: Merged counters.
+    """
+    for n, counts in other.items():
+        if n in counters:
+            counters[n] += counts
+        else:
+            counters[n] = counts.copy()
+    return counters
+
+
+def signature_label(code, length):
+    """
+    Turn a signature code back into its string of results.
+
+    :param int code: Signature code.
+    :param int length: Signature length.
+    :return: String of 'P', 'B' and 'T', oldest result first.
+    """
+    return ''.join(RESULTS[code // 3 ** i % 3] for i in range(length - 1, -1, -1))
+
+
+def signature_codes(results, length):
+    """
+    Roll base 3 codes of the last `length` results before each result.
+
+    Codes are only complete from index `length` on, before that they only
+    include the results that exist.
+
+    :param numpy.ndarray results: Results in order of play as PLAYER, BANK or TIE.
+    :param int length: Signature length.
+    :return: Array of signature codes, one per result.
+    """
+    codes = np.zeros(len(results), dtype=np.int64)
+    for i in range(1, min(length, len(results)) + 1):
+        codes[i:] += results[:-i] * 3 ** (i - 1)
+    return codes
+
+
+def count_signatures(counters, results):
+    """
+    Count results following each tracked signature within a shoe.
+
+    :param dict counters: Counters as from new_counters, updated in place.
+    :param results: Results of one shoe in order of play as PLAYER, BANK or TIE.
+    """
+    results = np.asarray(results, dtype=np.int64)
+    codes = signature_codes(results, max(counters))
+    for n, counts in counters.items():
+        if len(results) <= n:
+            continue
+        # Shorter signatures are the lower digits of the longest one.
+        np.add.at(counts.reshape(-1), codes[n:] % 3 ** n * 3 + results[n:], 1)
+
+
+def new_odds_sums(results_to_track_min=5, results_to_track_max=8):
+    """
+    Make empty sums of exact game odds by result signature, for control
+    variates in signature_stats.
+
+    Games in a shoe are not independent, so sums are of per shoe totals.
+    With g games, w wins and p summed odds of a result following a signature
+    in a shoe, sums for each length are indexed by [code, stat, result] with
+    stats p, w * w, p * p, w * p, g * g, g * w and g * p, summed over shoes.
+
+    :param int results_to_track_min: Min length of results to track.
+    :param int results_to_track_max: Max length of results to track.
+    :return: Dict of sum arrays keyed by signature length.
+    """
+    return {n: np.zeros((3 ** n, 7, 3)) for n in range(results_to_track_min, results_to_track_max + 1)}
+
+
+def count_signature_odds(odds_sums, results, odds):
+    """
+    Add up exact odds of games following each tracked signature within a shoe.
+
+    :param dict odds_sums: Sums as from new_odds_sums, updated in place.
+    :param results: Results of one shoe in order of play as PLAYER, BANK or TIE.
+    :param numpy.ndarray odds: Odds of each game before it was played, as from Shoe.odds.
+    """
+    results = np.asarray(results, dtype=np.int64)
+    odds = np.asarray(odds, dtype=np.float64).reshape(len(results), 3)
+    won = (results[:, None] == np.arange(3)).astype(np.float64)
+    codes = signature_codes(results, max(odds_sums))
+    for n, sums in odds_sums.items():
+        if len(results) <= n:
+            continue
+        keys, groups = np.unique(codes[n:] % 3 ** n, return_inverse=True)
+        games = np.bincount(groups, minlength=len(keys))[:, None].astype(np.float64)
+        wins = np.zeros((len(keys), 3))
+        np.add.at(wins, groups, won[n:])
+        total_odds = np.zeros((len(keys), 3))
+        np.add.at(total_odds, groups, odds[n:])
+        sums[keys] += np.stack((total_odds, wins * wins, total_odds * total_odds, wins * total_odds,
+                                np.repeat(games * games, 3, axis=1), games * wins, games * total_odds), axis=1)
+
+
+def new_position_counters(results_to_track_min=5, results_to_track_max=8, num_decks=8, bucket_size=52):
+    """
+    Make empty result signature counters split by position in the shoe.
+
+    Counters for each length are indexed by [bucket, code, result], games
+    being in bucket cards_left // bucket_size by the number of cards left
+    before they were dealt.
+
+    :param int results_to_track_min: Min length of results to track.
+    :param int results_to_track_max: Max length of results to track.
+    :param int num_decks: Number of decks in shoe.
+    :param int bucket_size: Number of cards per bucket.
+    :return: Dict of counter arrays keyed by signature length.
+    """
+    num_buckets = num_decks * 13 * 4 // bucket_size + 1
+    return {n: np.zeros((num_buckets, 3 ** n, 3), dtype=np.int64)
+            for n in range(results_to_track_min, results_to_track_max + 1)}
+
+
+def count_position_signatures(position_counters, results, cards_left, bucket_size=52, start=0):
+    """
+    Count results following each tracked signature within a shoe by the
+    number of cards left before each game.
+
+    :param dict position_counters: Counters as from new_position_counters, updated in place.
+    :param results: Results of the shoe so far in order of play as PLAYER, BANK or TIE.
+    :param cards_left: Cards left before each game from index start on, as from Shoe.cursors.
+    :param int bucket_size: Number of cards per bucket.
+    :param int start: Index of the first game to count, games before it are only used as signatures.
+    """
+    results = np.asarray(results, dtype=np.int64)
+    buckets = np.asarray(cards_left, dtype=np.int64) // bucket_size
+    codes = signature_codes(results[max(start - max(position_counters), 0):], max(position_counters))
+    codes = codes[len(codes) - len(buckets):]
+    for n, counts in position_counters.items():
+        first = max(n - start, 0)
+        if first >= len(buckets):
+            continue
+        keys = (buckets[first:] * 3 ** n + codes[first:] % 3 ** n) * 3 + results[start + first:]
+        np.add.at(counts.reshape(-1), keys, 1)
+
+
+def position_stats(position_counters, alpha=0.05, looks=1, min_played=MIN_PLAYED, bucket_size=52):
+    """
+    Estimate win ratios of every signature in every bucket of cards left,
+    same as signature_stats, with signatures of all buckets counted as
+    tested for the Bonferroni correction.
+
+    :param dict position_counters: Counters as from new_position_counters.
+    :param float alpha: Overall chance of any false result.
+    :param int looks: Number of times stats are looked at during a run.
+    :param int min_played: Min number of games played to test a signature in a bucket.
+    :param int bucket_size: Number of cards per bucket.
+    :return: DataFrame with one row per signature and bucket tested, indexed
+             by signature and range of cards left, ratios in percent.
+    """
+    labels = []
+    rows = []
+    for n, counts in position_counters.items():
+        played = counts.sum(axis=2)
+        buckets, codes = np.nonzero(played >= max(min_played, 1))
+        labels += [(signature_label(code, n), '%d-%d' % (bucket * bucket_size, (bucket + 1) * bucket_size - 1))
+                   for bucket, code in zip(buckets, codes)]
+        rows.append(counts[buckets, codes])
+
+    wins = np.concatenate(rows) if rows else np.zeros((0, 3), dtype=np.int64)
+    df = win_ratio_stats(labels, wins, alpha, looks)
+    df.index = MultiIndex.from_tuples(labels, names=['Signature', 'Cards left'])
+    return df
+
+
+class PatternSketch:
+    """
+    Count results following signatures too long for arrays of every code,
+    in a fixed amount of memory.
+
+    Every signature is counted in a count-min sketch, which can only ever
+    overcount. The most played signatures are also kept in a heavy hitters
+    table and counted exactly from the time they enter it, apart from the
+    sketch estimate they entered with, which is their max error.
+
+    Counts are buffered and added in batches, call flush before reading.
+    """
+
+    def __init__(self, length=20, width=1 << 18, depth=4, num_heavy=10000, seed=0):
+        """
+        :param int length: Signature length, up to 39 to fit codes in int64.
+        :param int width: Number of buckets per row of the sketch, a power of 2.
+        :param int depth: Number of rows of the sketch.
+        :param int num_heavy: Number of signatures to keep in the heavy hitters table.
+        :param int seed: Seed for hashing, sketches can only be merged with the same seed.
+        """
+        if not 0 < length < 40:
+            raise ValueError('Signature length must be between 1 and 39, got %d.' % length)
+        if width & (width - 1):
+            raise ValueError('Sketch width must be a power of 2, got %d.' % width)
+        self.length = length
+        self.num_heavy = num_heavy
+        self.seed = seed
+        self.shift = np.uint64(64 - width.bit_length() + 1)
+        self.multipliers = np.random.default_rng(seed).integers(1 << 62, size=depth, dtype=np.uint64) * 2 + 1
+        self.counts = np.zeros((depth, width, 3), dtype=np.int64)
+        self.heavy_codes = np.zeros(0, dtype=np.int64)
+        self.heavy_counts = np.zeros((0, 3), dtype=np.int64)
+        self.heavy_errors = np.zeros((0, 3), dtype=np.int64)
+        self.pending = []
+        self.pending_shoes = []
+        self.num_pending = 0
+
+    @property
+    def settings(self):
+        """
+        :return: List of length, width, depth, num_heavy and seed, to make an empty copy with.
+        """
+        depth, width, _ = self.counts.shape
+        return [self.length, width, depth, self.num_heavy, self.seed]
+
+    def buckets(self, codes, depth=None):
+        """
+        :param numpy.ndarray codes: Signature codes.
+        :param int depth: Number of sketch rows to hash for, defaults to all.
+        :return: 2D array of sketch buckets of codes, one row per sketch row.
+        """
+        multipliers = self.multipliers[:depth]
+        if self.shift == 64:
+            return np.zeros((len(multipliers), len(codes)), dtype=np.int64)
+        hashes = codes.astype(np.uint64)[None, :] * multipliers[:, None]
+        return (hashes >> self.shift).astype(np.int64)
+
+    def estimate(self, codes):
+        """
+        Estimate results following signatures from the sketch alone.
+
+        :param numpy.ndarray codes: Signature codes.
+        :return: 2D array of player wins, bank wins and ties, one row per code.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        buckets = self.buckets(codes)
+        return self.counts[np.arange(len(buckets))[:, None], buckets].min(axis=0)
+
+    def add_shoe(self, results, batch_size=1 << 16):
+        """
+        Count results following every signature within a shoe.
+
+        :param results: Results of one shoe in order of play as PLAYER, BANK or TIE.
+        :param int batch_size: Number of results to buffer before adding them to the sketch.
+        """
+        self.pending_shoes += results
+        self.pending_shoes.append(SHOE_END)
+        self.num_pending += len(results)
+        if self.num_pending >= batch_size:
+            self.flush()
+
+    def add(self, codes, results, batch_size=1 << 16):
+        """
+        Count results following signatures.
+
+        :param numpy.ndarray codes: Codes of signatures of length `length`, as from signature_codes.
+        :param numpy.ndarray results: Result following each signature.
+        :param int batch_size: Number of results to buffer before adding them to the sketch.
+        """
+        self.pending.append((codes, results))
+        self.num_pending += len(codes)
+        if self.num_pending >= batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Add buffered results to the sketch and heavy hitters table.
+        """
+        if self.pending_shoes:
+            results, codes, history, _ = stream_signatures(self.pending_shoes, self.length)
+            self.pending.append((codes[history >= self.length], results[history >= self.length]))
+            self.pending_shoes = []
+        if not self.pending:
+            return
+        codes = np.concatenate([codes for codes, _ in self.pending])
+        results = np.concatenate([results for _, results in self.pending])
+        self.pending = []
+        self.num_pending = 0
+
+        keys, groups = np.unique(codes, return_inverse=True)
+        counts = np.bincount(groups * 3 + results, minlength=len(keys) * 3).reshape(-1, 3)
+        for row, buckets in enumerate(self.buckets(keys)):
+            np.add.at(self.counts[row], buckets, counts)
+
+        # Heavy hitters are counted exactly, the rest try to get in by their estimates.
+        positions = np.minimum(np.searchsorted(self.heavy_codes, keys), max(len(self.heavy_codes) - 1, 0))
+        known = np.zeros(len(keys), dtype=bool)
+        if len(self.heavy_codes):
+            known = self.heavy_codes[positions] == keys
+        np.add.at(self.heavy_counts, positions[known], counts[known])
+        candidates = keys[~known]
+        if len(self.heavy_codes) >= self.num_heavy:
+            # Estimates are at most the first row, skip those that can't beat the lightest heavy hitter.
+            lightest = (self.heavy_counts + self.heavy_errors).sum(axis=1).min()
+            candidates = candidates[self.counts[0, self.buckets(candidates, 1)[0]].sum(axis=1) > lightest]
+        self.keep_heaviest(np.concatenate((self.heavy_codes, candidates)),
+                           np.concatenate((self.heavy_counts, np.zeros((len(candidates), 3), dtype=np.int64))),
+                           np.concatenate((self.heavy_errors, self.estimate(candidates))))
+
+    def keep_heaviest(self, codes, counts, errors):
+        """
+        Replace the heavy hitters table with the num_heavy most played of codes.
+
+        :param numpy.ndarray codes: Unique signature codes.
+        :param numpy.ndarray counts: Exact player wins, bank wins and ties of each code.
+        :param numpy.ndarray errors: Estimated player wins, bank wins and ties of each code
+                                     from before it was counted exactly.
+        """
+        if len(codes) > self.num_heavy:
+            heaviest = np.argpartition(-(counts + errors).sum(axis=1), self.num_heavy - 1)[:self.num_heavy]
+            codes, counts, errors = codes[heaviest], counts[heaviest], errors[heaviest]
+        order = np.argsort(codes)
+        self.heavy_codes, self.heavy_counts, self.heavy_errors = codes[order], counts[order], errors[order]
+
+    def merge(self, other):
+        """
+        Add counts of another sketch with the same settings into this one.
+
+        :param PatternSketch other: Sketch to add.
+        :return: Merged sketch.
+        """
+        if other.settings[:3] + other.settings[4:] != self.settings[:3] + self.settings[4:]:
+            raise ValueError('Can only merge sketches with the same length, size and seed.')
+        self.flush()
+        other.flush()
+
+        # Signatures only heavy in one sketch take estimates from the other.
+        codes = np.union1d(self.heavy_codes, other.heavy_codes)
+        counts = np.zeros((len(codes), 3), dtype=np.int64)
+        errors = np.zeros((len(codes), 3), dtype=np.int64)
+        for sketch in (self, other):
+            known = np.isin(codes, sketch.heavy_codes)
+            counts[known] += sketch.heavy_counts
+            errors[known] += sketch.heavy_errors
+            errors[~known] += sketch.estimate(codes[~known])
+
+        self.counts += other.counts
+        self.keep_heaviest(codes, counts, errors)
+        return self
+
+    def heavy_hitters(self):
+        """
+        :return: DataFrame of the heavy hitters table by signature, most played first,
+                 with max overcount of games played.
+        """
+        self.flush()
+        estimates = self.heavy_counts + self.heavy_errors
+        order = np.argsort(-estimates.sum(axis=1), kind='stable')
+        df = DataFrame(index=[signature_label(code, self.length) for code in self.heavy_codes[order]])
+        df['Played'] = estimates[order].sum(axis=1)
+        for i, title in enumerate(['Player', 'Bank', 'Tie']):
+            df[title] = estimates[order, i]
+        df['Error'] = self.heavy_errors[order].sum(axis=1)
+        return df
+
+    def arrays(self):
+        """
+        :return: Dict of arrays to save the sketch with, for from_arrays.
+        """
+        self.flush()
+        return {
+            'settings': np.array(self.settings, dtype=np.int64),
+            'counts': self.counts,
+            'heavy_codes': self.heavy_codes,
+            'heavy_counts': self.heavy_counts,
+            'heavy_errors': self.heavy_errors,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """
+        :param dict arrays: Arrays as from arrays.
+        :return: PatternSketch.
+        """
+        sketch = cls(*arrays['settings'].tolist())
+        sketch.counts = arrays['counts'].copy()
+        sketch.heavy_codes = arrays['heavy_codes'].copy()
+        sketch.heavy_counts = arrays['heavy_counts'].copy()
+        sketch.heavy_errors = arrays['heavy_errors'].copy()
+        return sketch
+
+
+def save_checkpoint(path, counters, games_left=0, cards=(), shoe_results=(), rng=None, config=None, recorded=0,
+                    odds_sums=None, shoe_game_odds=(), sketch=None, position_counters=None):
+    """
+    Save counters, and the state needed to resume a run, to a compressed file.
+
+    The file is written next to path first and then moved in place, so a crash
+    while saving leaves the previous checkpoint intact.
+
+    :param str path: File to save to.
+    :param dict counters: Counters as from new_counters.
+    :param int games_left: Number of games still to play.
+    :param list cards: Cards left in the current shoe.
+    :param list shoe_results: Results of the current shoe not yet counted.
+    :param rng: Random number generator to resume with, only numpy Generator state is kept.
+    :param dict config: Run settings, checked on resume.
+    :param int recorded: Number of symbols recorded by OutcomeRecorder so far.
+    :param dict odds_sums: Sums as from new_odds_sums.
+    :param shoe_game_odds: Odds of games of the current shoe not yet counted.
+    :param PatternSketch sketch: Sketch of long signatures.
+    :param dict position_counters: Counters as from new_position_counters.
+    """
+    rng_state = rng.bit_generator.state if isinstance(rng, np.random.Generator) else None
+    arrays = {'counts_%d' % n: counts for n, counts in counters.items()}
+    arrays.update({'odds_%d' % n: sums for n, sums in (odds_sums or {}).items()})
+    arrays.update({'position_%d' % n: counts for n, counts in (position_counters or {}).items()})
+    if sketch is not None:
+        arrays.update({'sketch_' + name: array for name, array in sketch.arrays().items()})
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(
+            f,
+            games_left=np.int64(games_left),
+            cards=np.array(cards, dtype=np.int8),
+            shoe_results=np.array(shoe_results, dtype=np.int8),
+            rng_state=np.array(json.dumps(rng_state)),
+            config=np.array(json.dumps(config)),
+            recorded=np.int64(recorded),
+            shoe_game_odds=np.array(shoe_game_odds, dtype=np.float64).reshape(-1, 3),
+            **arrays
+        )
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint(path):
+    """
+    Load a file saved by save_checkpoint.
+
+    :param str path: File to load.
+    :return: Dict of counters, games_left, cards, shoe_results, rng_state, config, recorded,
+             odds_sums, shoe_game_odds, sketch and position_counters.
+    """
+    with np.load(path) as data:
+        counters = {int(k[len('counts_'):]): data[k] for k in data.files if k.startswith('counts_')}
+        odds_sums = {int(k[len('odds_'):]): data[k] for k in data.files if k.startswith('odds_')}
+        sketch_arrays = {k[len('sketch_'):]: data[k] for k in data.files if k.startswith('sketch_')}
+        position_counters = {int(k[len('position_'):]): data[k] for k in data.files if k.startswith('position_')}
+        return {
+            'counters': dict(sorted(counters.items())),
+            'games_left': int(data['games_left']),
+            'cards': data['cards'].tolist(),
+            'shoe_results': data['shoe_results'].tolist(),
+            'rng_state': json.loads(str(data['rng_state'])),
+            'config': json.loads(str(data['config'])),
+            'recorded': int(data['recorded']) if 'recorded' in data.files else 0,
+            'odds_sums': dict(sorted(odds_sums.items())),
+            'shoe_game_odds': data['shoe_game_odds'] if 'shoe_game_odds' in data.files else np.zeros((0, 3)),
+            'sketch': PatternSketch.from_arrays(sketch_arrays) if sketch_arrays else None,
+            'position_counters': dict(sorted(position_counters.items())),
+        }
+
+
+def merge_result_files(paths):
+    """
+    Merge counters of result or checkpoint files from separate runs.
+
+    Sums of exact odds, sketches and position counters are only merged if
+    every file has them, as they need to cover all the games counted.
+
+    :param list paths: Files saved by save_checkpoint.
+    :return: Dict of merged counters, odds_sums, sketch and position_counters,
+             each of the last 3 None if any file has none.
+    """
+    counters = {}
+    odds_sums = {}
+    sketch = None
+    position_counters = {}
+    for i, path in enumerate(paths):
+        checkpoint = load_checkpoint(path)
+        merge_counters(counters, checkpoint['counters'])
+        if odds_sums is not None and checkpoint['odds_sums']:
+            merge_counters(odds_sums, checkpoint['odds_sums'])
+        else:
+            odds_sums = None
+        if checkpoint['sketch'] is None or (i and sketch is None):
+            sketch = None
+        elif sketch is None:
+            sketch = checkpoint['sketch']
+        else:
+            sketch.merge(checkpoint['sketch'])
+        if position_counters is not None and checkpoint['position_counters']:
+            merge_counters(position_counters, checkpoint['position_counters'])
+        else:
+            position_counters = None
+    return {
+        'counters': dict(sorted(counters.items())),
+        'odds_sums': odds_sums and dict(sorted(odds_sums.items())),
+        'sketch': sketch,
+        'position_counters': position_counters and dict(sorted(position_counters.items())),
+    }
+
+
+def pack_symbols(symbols):
+    """
+    Pack results and SHOE_END markers 4 to a byte, 2 bits each, first one in
+    the lowest bits. The last byte is padded with zeros.
+
+    :param symbols: Results as PLAYER, BANK or TIE, or SHOE_END.
+    :return: Packed bytes.
+    """
+    symbols = np.asarray(symbols, dtype=np.uint8)
+    symbols = np.concatenate((symbols, np.zeros(-len(symbols) % 4, dtype=np.uint8))).reshape(-1, 4)
+    return (symbols[:, 0] | symbols[:, 1] << 2 | symbols[:, 2] << 4 | symbols[:, 3] << 6).tobytes()
+
+
+class OutcomeRecorder:
+    """
+    Record the stream of results to a file, packed by pack_symbols after a
+    header of RECORDING_MAGIC and the number of symbols as uint64.
+
+    Shoes are ended with a SHOE_END marker. The last partial byte is always
+    on disk and rewritten by the next write, so every symbol recorded is
+    kept by flush.
+    """
+
+    def __init__(self, path, resume_at=None):
+        """
+        :param str path: File to record to.
+        :param int resume_at: Number of symbols to keep from an existing
+                              recording, anything after is dropped. None or 0
+                              to start a new recording.
+        """
+        self.pending = []
+        if resume_at and not os.path.exists(path):
+            raise ValueError('Cannot resume recording %s after %d symbols, the file does not exist. '
+                             'Resume with the record directory the run was started with.' % (path, resume_at))
+        if not resume_at:
+            self.file = open(path, 'w+b')
+            self.file.seek(RECORDING_HEADER.size)
+            self.count = 0
+        else:
+            self.file = open(path, 'r+b')
+            self.count = resume_at
+            self.file.seek(RECORDING_HEADER.size + resume_at // 4)
+            if resume_at % 4:
+                self.pending = unpack_symbols(self.file.read(1))[:resume_at % 4].tolist()
+                self.file.seek(-1, os.SEEK_CUR)
+            self.file.truncate(RECORDING_HEADER.size + (resume_at + 3) // 4)
+        self.flush()
+
+    def write(self, symbols):
+        """
+        :param symbols: Results as PLAYER, BANK or TIE, or SHOE_END.
+        """
+        self.count += len(symbols)
+        self.pending += list(symbols)
+        self.file.write(pack_symbols(self.pending))
+        num_full = len(self.pending) // 4 * 4
+        if num_full < len(self.pending):
+            self.file.seek(-1, os.SEEK_CUR)
+        self.pending = self.pending[num_full:]
+
+    def write_shoe(self, results):
+        """
+        :param results: Results of a whole shoe as PLAYER, BANK or TIE.
+        """
+        self.write(list(results) + [SHOE_END])
+
+    def flush(self):
+        """
+        Update the header and flush to disk.
+        """
+        position = self.file.tell()
+        self.file.seek(0)
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, self.count))
+        self.file.seek(position)
+        self.file.flush()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def unpack_symbols(packed):
+    """
+    :param packed: Bytes packed by pack_symbols.
+    :return: uint8 array of 4 symbols per byte.
+    """
+    return UNPACKED_BYTES[np.frombuffer(packed, dtype=np.uint8)].reshape(-1)
+
+
+def load_recording(path):
+    """
+    Memory map a recording.
+
+    :param str path: File recorded by OutcomeRecorder.
+    :return: Tuple of packed bytes as a read only uint8 array, and number of symbols.
+    """
+    with open(path, 'rb') as f:
+        magic, count = RECORDING_HEADER.unpack(f.read(RECORDING_HEADER.size))
+    if magic != RECORDING_MAGIC:
+        raise ValueError('%s is not a recording of results.' % path)
+    if not count:
+        return np.zeros(0, dtype=np.uint8), 0
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=RECORDING_HEADER.size, shape=((count + 3) // 4,)), count
+
+
+def iter_recording(path, chunk_size=1 << 24):
+    """
+    Read a recording in chunks of unpacked symbols.
+
+    :param str path: File recorded by OutcomeRecorder.
+    :param int chunk_size: Number of symbols per chunk, multiple of 4.
+    :return: Generator of uint8 arrays of results as PLAYER, BANK or TIE, or SHOE_END.
+    """
+    packed, count = load_recording(path)
+    for start in range(0, len(packed), chunk_size // 4):
+        yield unpack_symbols(packed[start:start + chunk_size // 4])[:count - start * 4]
+
+
+def stream_signatures(symbols, length, carry=None):
+    """
+    Signature codes over a chunk of a stream of results, where signatures
+    never run across a SHOE_END marker.
+
+    :param numpy.ndarray symbols: Results as PLAYER, BANK or TIE, or SHOE_END.
+    :param int length: Signature length.
+    :param tuple carry: Carry returned for the previous chunk of the stream.
+    :return: Tuple of results, their signature codes as from signature_codes,
+             number of results before each of them within its shoe, and carry
+             to pass with the next chunk.
+    """
+    tail, run = carry or (np.zeros(0, dtype=np.int64), 0)
+    symbols = np.concatenate((tail, np.asarray(symbols, dtype=np.int64)))
+
+    # Number of results before each symbol within its shoe.
+    positions = np.arange(len(symbols)) - len(tail)
+    is_end = symbols == SHOE_END
+    last_end = np.maximum.accumulate(np.where(is_end, positions, -1 - run))
+    since_end = positions - last_end - 1
+
+    results = np.where(is_end, 0, symbols)
+    codes = signature_codes(results, length)
+    keep = ~is_end
+    keep[:len(tail)] = False
+
+    if len(symbols):
+        carry = symbols[-length:], 0 if is_end[-1] else int(since_end[-1]) + 1
+    return results[keep], codes[keep], since_end[keep], carry
+
+
+def count_stream_signatures(counters, symbols, carry=None):
+    """
+    Count results following each tracked signature over a chunk of a stream
+    of results, as from stream_signatures.
+
+    :param dict counters: Counters as from new_counters, updated in place.
+    :param numpy.ndarray symbols: Results as PLAYER, BANK or TIE, or SHOE_END.
+    :param tuple carry: Carry returned for the previous chunk of the stream.
+    :return: Carry to pass with the next chunk.
+    """
+    results, codes, history, carry = stream_signatures(symbols, max(counters), carry)
+    for n, counts in counters.items():
+        valid = history >= n
+        keys = codes[valid] % 3 ** n * 3 + results[valid]
+        counts += np.bincount(keys, minlength=counts.size).reshape(counts.shape)
+    return carry
+
+
+def replay_counters(paths, results_to_track_min=5, results_to_track_max=8, chunk_size=1 << 24):
+    """
+    Count signatures over recordings instead of playing games.
+
+    :param list paths: Files recorded by OutcomeRecorder.
+    :param int results_to_track_min: Min length of results to track.
+    :param int results_to_track_max: Max length of results to track.
+    :param int chunk_size: Number of symbols to unpack at a time.
+    :return: Counters as from new_counters.
+    """
+    counters = new_counters(results_to_track_min, results_to_track_max)
+    for path in paths:
+        carry = None
+        for symbols in iter_recording(path, chunk_size):
+            carry = count_stream_signatures(counters, symbols, carry)
+    return counters
+
+
+def replay_sketch(paths, sketch, chunk_size=1 << 24):
+    """
+    Count long signatures over recordings into a PatternSketch.
+
+    :param list paths: Files recorded by OutcomeRecorder.
+    :param PatternSketch sketch: Sketch to count in.
+    :param int chunk_size: Number of symbols to unpack at a time.
+    :return: The sketch.
+    """
+    for path in paths:
+        carry = None
+        for symbols in iter_recording(path, chunk_size):
+            results, codes, history, carry = stream_signatures(symbols, sketch.length, carry)
+            valid = history >= sketch.length
+            sketch.add(codes[valid], results[valid])
+    sketch.flush()
+    return sketch
+
+
+def betting_strategies(length=4, progressions=None):
+    """
+    Make a set of strategies to backtest: always betting one side, following
+    or going against the last result, and betting each side after each
+    signature, each with every progression.
+
+    :param int length: Length of the signatures strategies look at.
+    :param dict progressions: Name to tuple of units to stake after 0, 1, 2... losses in a row,
+                              starting over after the last one. Defaults to flat and martingale.
+    :return: Dict of strategy name to tuple of bets per signature code, and progression.
+    """
+    if progressions is None:
+        progressions = {'flat': (1,), 'martingale': (1, 2, 4, 8, 16, 32, 64)}
+
+    codes = np.arange(3 ** length)
+    last = codes % 3
+    bet_tables = {
+        'always %s' % RESULTS[side]: np.full(3 ** length, side) for side in (PLAYER, BANK, TIE)
+    }
+    bet_tables['follow'] = np.where(last == TIE, NO_RESULT, last)
+    bet_tables['against'] = np.where(last == TIE, NO_RESULT, 1 - last)
+    for code in codes:
+        for side in (PLAYER, BANK, TIE):
+            bets = np.full(3 ** length, NO_RESULT)
+            bets[code] = side
+            bet_tables['%s>%s' % (signature_label(code, length), RESULTS[side])] = bets
+
+    return {
+        '%s %s' % (name, progression_name): (bets.astype(np.int8), progression)
+        for progression_name, progression in progressions.items()
+        for name, bets in bet_tables.items()
+    }
+
+
+def loss_streaks(wins, losses, carry=0):
+    """
+    Count losses in a row before each bet, pushes keep the streak going.
+
+    :param numpy.ndarray wins: Bool array of bets won.
+    :param numpy.ndarray losses: Bool array of bets lost.
+    :param int carry: Streak before the first bet.
+    :return: Tuple of array of streaks by bet, and streak after the last bet.
+    """
+    losses_before = carry + np.cumsum(losses) - losses
+
+    # Streaks count from the bet after the last win, if any.
+    after_win = np.maximum.accumulate(np.where(wins, np.arange(1, len(wins) + 1), 0))
+    after_win = np.concatenate(([0], after_win[:-1]))
+    streaks = losses_before - np.where(after_win > 0, losses_before[after_win], 0)
+
+    return streaks, 0 if wins[-1] else int(streaks[-1] + losses[-1])
+
+
+def backtest(paths, strategies, length=4, chunk_size=1 << 22, curve_every=100000):
+    """
+    Bet every strategy over recorded results.
+
+    Strategies bet on a game by the signature of the results before it in the
+    shoe, so they sit out the first `length` games of each shoe. Bets pay as
+    in bet_evs, with ties pushing player and bank bets.
+
+    Games of each chunk are grouped by signature once, so each strategy only
+    does work for the games it bets on.
+
+    :param list paths: Files recorded by OutcomeRecorder.
+    :param dict strategies: Name to tuple of bets per signature code and progression,
+                            as from betting_strategies.
+    :param int length: Length of signatures the strategies were made for.
+    :param int chunk_size: Number of symbols to bet at a time, multiple of 4.
+    :param int curve_every: Number of games between points of the bankroll curves.
+    :return: Tuple of DataFrame of bets, units wagered, profit, EV per unit wagered
+             and max drawdown by strategy, and array of bankrolls every curve_every
+             games by strategy.
+    """
+    names = list(strategies)
+    bet_codes = [np.flatnonzero(strategies[name][0] != NO_RESULT) for name in names]
+
+    num_bets = np.zeros(len(names), dtype=np.int64)
+    wagered = np.zeros(len(names))
+    bankroll = np.zeros(len(names))
+    peak = np.zeros(len(names))
+    max_drawdown = np.zeros(len(names))
+    streak = [0] * len(names)
+    curves = []
+    games_played = 0
+
+    for path in paths:
+        carry = None
+        for symbols in iter_recording(path, chunk_size):
+            results, codes, history, carry = stream_signatures(symbols, length, carry)
+            num_games = len(results)
+            codes = np.where(history >= length, codes, 3 ** length)
+
+            # Games by signature, in order of play within each.
+            by_code = np.argsort(codes, kind='stable')
+            code_starts = np.concatenate(([0], np.cumsum(np.bincount(codes, minlength=3 ** length + 1))))
+            points = np.arange((-games_played - 1) % curve_every, num_games, curve_every)
+            curve = np.zeros((len(names), len(points)))
+
+            for i, name in enumerate(names):
+                bets, progression = strategies[name]
+                if len(bet_codes[i]) == 1:
+                    code = bet_codes[i][0]
+                    games = by_code[code_starts[code]:code_starts[code + 1]]
+                else:
+                    games = np.flatnonzero(bets[np.minimum(codes, 3 ** length - 1)] != NO_RESULT)
+                    games = games[codes[games] < 3 ** length]
+
+                if len(games):
+                    units = BET_PROFITS[bets[codes[games]], results[games]]
+                    if len(progression) > 1:
+                        streaks, streak[i] = loss_streaks(units > 0, units < 0, streak[i])
+                        stakes = np.asarray(progression, dtype=np.float64)[streaks % len(progression)]
+                    else:
+                        stakes = np.full(len(games), float(progression[0]))
+                    bankrolls = bankroll[i] + np.cumsum(stakes * units)
+                    peaks = np.maximum(peak[i], np.maximum.accumulate(bankrolls))
+                    max_drawdown[i] = max(max_drawdown[i], (peaks - bankrolls).max())
+                    num_bets[i] += len(games)
+                    wagered[i] += stakes.sum()
+
+                    # Bankroll after the last bet at or before each point.
+                    last_bets = np.searchsorted(games, points, side='right') - 1
+                    curve[i] = np.where(last_bets >= 0, bankrolls[last_bets], bankroll[i])
+                    bankroll[i], peak[i] = bankrolls[-1], peaks[-1]
+                else:
+                    curve[i] = bankroll[i]
+
+            curves.append(curve)
+            games_played += num_games
+
+    df = DataFrame({
+        'Bets': num_bets,
+        'Wagered': wagered,
+        'Profit': bankroll.round(2),
+        'EV': np.divide(bankroll, wagered, out=np.zeros(len(names)), where=wagered > 0).round(5),
+        'Max drawdown': max_drawdown.round(2),
+    }, index=names)
+    return df, np.concatenate(curves, axis=1) if curves else np.zeros((len(names), 0))
+
+
+def peak_memory():
+    """
+    :return: Peak memory used by this process in bytes, None where it can't be told.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if platform.system() == 'Darwin' else peak * 1024
+
+
+class ProgressReporter:
+    """
+    Print progress of a run from a background thread.
+
+    Shards put their progress in `shared` under their own key every so
+    often, as a tuple of games played in total and in this run, shoes
+    shuffled in this run, signatures seen, process id and peak memory of the
+    process. Use a multiprocessing Manager dict for shards playing in other
+    processes.
+    """
+
+    def __init__(self, num_games, interval=10.0, shared=None, stream=None):
+        """
+        :param int num_games: Number of games in the whole run.
+        :param float interval: Seconds between reports.
+        :param dict shared: Dict shards report to, defaults to a new dict.
+        :param stream: File to print to, defaults to stderr.
+        """
+        self.num_games = num_games
+        self.interval = interval
+        self.shared = {} if shared is None else shared
+        self.stream = stream
+        self.started = None
+        self.last = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self.last = (self.started, 0, 0)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """
+        Stop reporting, after a last report.
+        """
+        self.stopped.set()
+        self.thread.join()
+        self.report()
+
+    def report(self):
+        """
+        Print a line of games and shuffles per second since the last report,
+        signatures seen, peak memory and ETA.
+
+        :return: The line printed.
+        """
+        now = time.monotonic()
+        shards = list(self.shared.values())
+        games = sum(shard[0] for shard in shards)
+        games_run = sum(shard[1] for shard in shards)
+        shuffles_run = sum(shard[2] for shard in shards)
+        signatures = max([shard[3] for shard in shards] or [0])
+        memory = {}
+        for shard in shards:
+            if shard[5] is not None:
+                memory[shard[4]] = max(memory.get(shard[4], 0), shard[5])
+        if peak_memory() is not None:
+            memory[os.getpid()] = peak_memory()
+
+        last_time, last_games, last_shuffles = self.last
+        elapsed = max(now - last_time, 1e-9)
+        self.last = (now, games_run, shuffles_run)
+        rate = games_run / max(now - self.started, 1e-9)
+        eta = (self.num_games - games) / rate if rate else None
+
+        line = '[%s] %d/%d games (%.1f%%), %.0f games/s, %.1f shuffles/s, %d signatures, %s, ETA %s' % (
+            format_seconds(now - self.started), games, self.num_games, 100 * games / max(self.num_games, 1),
+            (games_run - last_games) / elapsed, (shuffles_run - last_shuffles) / elapsed, signatures,
+            '%.0f MB peak' % (sum(memory.values()) / 1e6) if memory else 'memory unknown',
+            format_seconds(eta) if eta is not None else 'unknown')
+        print(line, file=self.stream or sys.stderr, flush=True)
+        return line
+
+
+def format_seconds(seconds):
+    """
+    :param float seconds: Duration in seconds.
+    :return: Duration as H:MM:SS.
+    """
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return '%d:%02d:%02d' % (hours, minutes, seconds)
+
+
+def play_games_shard(num_games, num_decks_in_shoe=8, decks_discarded=2, num_cards_to_discard=0,
+                     results_to_track_min=5, results_to_track_max=8, seed=None,
+                     checkpoint_path=None, checkpoint_every=1000000, record_path=None,
+                     control=False, sketch=None,
+                     progress=None, progress_key=0, progress_every=10.0,
+                     position_bucket=None):
+    """
+    Play multiple games and record result signature counters.
+
+    With checkpoint_path set, progress is saved every checkpoint_every games,
+    and a run with an existing checkpoint resumes from it instead of starting
+    over. Runs seeded with numpy resume on the exact same random stream.
+
+    With record_path set, results of every shoe are also recorded there with
+    OutcomeRecorder, for replay_counters or other analyses later.
+
+    With control set, exact odds of every game are also added up by
+    signature with count_signature_odds, for control variates in
+    signature_stats.
+
+    With sketch set, signatures of its length are also counted in it, for
+    signatures too long to track with counters.
+
+    With position_bucket set, signatures are also counted by the number of
+    cards left before each game with count_position_signatures, in buckets
+    of position_bucket cards.
+
+    With progress set, progress is put in it under progress_key every
+    progress_every seconds, for ProgressReporter.
 
     :param int num_games: Number of games to play.
     :param int num_decks_in_shoe: Number of decks to use.
     :param int decks_discarded: Number of decks to cut, at which time reshuffle will happen.
-    :param int num_cards_to_discard: Number of cards to discard per game at start of dealing.
+    :param int num_cards_to_discard: Number of cards to burn per game at start of dealing.
     :param int results_to_track_min: Min length of results to track.
     :param int results_to_track_max: Max length of results to track.
-    :return:
+    :param seed: Seed or numpy SeedSequence for shuffling, None to shuffle with SystemRandom.
+    :param str checkpoint_path: File to save progress to and resume from.
+    :param int checkpoint_every: Number of games between checkpoints.
+    :param str record_path: File to record results to.
+    :param bool control: Whether to add up exact odds of games too.
+    :param PatternSketch sketch: Empty sketch to count long signatures in.
+    :param dict progress: Dict to report progress to, as ProgressReporter.shared.
+    :param progress_key: Key of this shard in progress.
+    :param float progress_every: Seconds between progress reports.
+    :param int position_bucket: Number of cards per bucket of cards left.
+    :return: Counters as from new_counters, or if control, sketch or position_bucket is set,
+             tuple of counters and dict of odds_sums as from new_odds_sums, the sketch and
+             position_counters as from new_position_counters, whichever are set.
     """
-    cards = prepare_cards(num_decks_in_shoe)
+    rng = make_rng(seed)
+    total_games = num_games
+    counters = new_counters(results_to_track_min, results_to_track_max)
+    config = {
+        'num_decks_in_shoe': num_decks_in_shoe,
+        'decks_discarded': decks_discarded,
+        'num_cards_to_discard': num_cards_to_discard,
+        'results_to_track_min': results_to_track_min,
+        'results_to_track_max': results_to_track_max,
+    }
+    if control:
+        config['control'] = True
+    if sketch is not None:
+        config['sketch'] = sketch.settings
+    if position_bucket:
+        config['position_bucket'] = position_bucket
+    odds_sums = new_odds_sums(results_to_track_min, results_to_track_max) if control else None
+    position_counters = None
+    if position_bucket:
+        position_counters = new_position_counters(results_to_track_min, results_to_track_max, num_decks_in_shoe,
+                                                  position_bucket)
+
+    # Results of the current shoe, counted on reshuffle.
+    shoe_results = []
+    shoe_game_odds = []
+    recorded = None
+
+    if checkpoint_path and os.path.exists(checkpoint_path):
+        checkpoint = load_checkpoint(checkpoint_path)
+        if checkpoint['config'] != config:
+            raise ValueError('Checkpoint %s was saved with different settings: %s'
+                             % (checkpoint_path, checkpoint['config']))
+        counters = checkpoint['counters']
+        num_games = checkpoint['games_left']
+        shoe = Shoe(num_decks_in_shoe, decks_discarded, rng, cards=checkpoint['cards'])
+        shoe_results = checkpoint['shoe_results']
+        if checkpoint['rng_state'] is not None:
+            rng.bit_generator.state = checkpoint['rng_state']
+        recorded = checkpoint['recorded']
+        if control:
+            odds_sums = checkpoint['odds_sums']
+            shoe_game_odds = [checkpoint['shoe_game_odds']]
+        if sketch is not None:
+            sketch = checkpoint['sketch']
+        if position_bucket:
+            position_counters = checkpoint['position_counters']
+    else:
+        shoe = Shoe(num_decks_in_shoe, decks_discarded, rng)
+    recorder = OutcomeRecorder(record_path, recorded) if record_path else None
 
-    # Placeholder to record result stats
-    result_signatures = {}
-    for i in range(results_to_track_min, results_to_track_max + 1):
-        result_signatures[i] = ''
-    games_played_for_result_signatures = {}
-    player_wins_for_result_signatures = {}
-    bank_wins_for_result_signatures = {}
-    ties_for_result_signatures = {}
+    def report_progress():
+        signatures = sum(int(np.count_nonzero(counts.any(axis=1))) for counts in counters.values())
+        progress[progress_key] = (total_games - num_games, resumed_games - num_games, shuffles, signatures,
+                                  os.getpid(), peak_memory())
+
+    shuffles = 0
+    resumed_games = num_games
+    reporting = progress is not None and progress_every
+    next_report = time.monotonic() + progress_every if reporting else None
 
     # Play games
     while num_games > 0:
-        num_games -= 1
-
         # Re-shuffle
-        if len(cards) <= decks_discarded * 13 * 4:
-            result_signatures = {}
-            for i in range(results_to_track_min, results_to_track_max + 1):
-                result_signatures[i] = ''
-            cards = prepare_cards(num_decks_in_shoe)
-
-        # Play game
-        result = play_game(cards, num_cards_to_discard)
-
-        # Record data
-        for i in range(results_to_track_min, results_to_track_max + 1):
-            if len(result_signatures[i]) == i:
-                # Result signature is full and can be used.
-                result_signature = result_signatures[i]
-                games_played_for_result_signatures[result_signature] = games_played_for_result_signatures.get(
-                    result_signature, 0) + 1
-                if result == 'P':
-                    player_wins_for_result_signatures[result_signature] = player_wins_for_result_signatures.get(
-                        result_signature, 0) + 1
-                elif result == 'B':
-                    bank_wins_for_result_signatures[result_signature] = bank_wins_for_result_signatures.get(
-                        result_signature, 0) + 1
-                else:
-                    ties_for_result_signatures[result_signature] = ties_for_result_signatures.get(
-                        result_signature, 0) + 1
+        if shoe.needs_shuffle:
+            shuffles += 1
+            count_signatures(counters, shoe_results)
+            if control:
+                count_signature_odds(odds_sums, shoe_results, np.concatenate([np.zeros((0, 3))] + shoe_game_odds))
+            if sketch is not None:
+                sketch.add_shoe(shoe_results)
+            if recorder and shoe_results:
+                recorder.write_shoe(shoe_results)
+            shoe_results = []
+            shoe_game_odds = []
+            shoe.shuffle()
+
+        # Play games until the cut card
+        cursor = len(shoe)
+        results = shoe.play(num_games, num_cards_to_discard)
+        shoe_results += results
+        games_played = len(results)
+        num_games -= games_played
+        if control:
+            shoe_game_odds.append(shoe.odds(cursor, games_played, num_cards_to_discard))
+        if position_bucket:
+            count_position_signatures(position_counters, shoe_results,
+                                      shoe.cursors(cursor, games_played, num_cards_to_discard), position_bucket,
+                                      len(shoe_results) - games_played)
+        if reporting and time.monotonic() >= next_report:
+            report_progress()
+            next_report = time.monotonic() + progress_every
 
-            # Update result signature for next iteration
-            result_signatures[i] += result
-            if len(result_signatures[i]) > i:
-                result_signatures[i] = result_signatures[i][1:]
+        if checkpoint_path and num_games // checkpoint_every != (num_games + games_played) // checkpoint_every:
+            if recorder:
+                recorder.flush()
+            save_checkpoint(checkpoint_path, counters, num_games, shoe.remaining(), shoe_results, rng, config,
+                            recorder.count if recorder else 0, odds_sums,
+                            np.concatenate([np.zeros((0, 3))] + shoe_game_odds), sketch, position_counters)
+
+    count_signatures(counters, shoe_results)
+    if control:
+        count_signature_odds(odds_sums, shoe_results, np.concatenate([np.zeros((0, 3))] + shoe_game_odds))
+    if sketch is not None:
+        sketch.add_shoe(shoe_results)
+        sketch.flush()
+    if recorder:
+        if shoe_results:
+            recorder.write_shoe(shoe_results)
+        recorder.close()
+    if progress is not None:
+        report_progress()
+    if checkpoint_path:
+        save_checkpoint(checkpoint_path, counters, config=config, recorded=recorder.count if recorder else 0,
+                        odds_sums=odds_sums, sketch=sketch, position_counters=position_counters)
+    extras = {'odds_sums': odds_sums, 'sketch': sketch, 'position_counters': position_counters}
+    extras = {name: extra for name, extra in extras.items() if extra is not None}
+    if extras:
+        return counters, extras
+    return counters
+
+
+def analyze_counters(counters):
+    """
+    Pick out result signatures with winning ratios good enough to bet on.
 
-    # Analyze recorded data
+    :param dict counters: Counters as from new_counters.
+    :return: DataFrame of games played and win ratios, one column per signature.
+    """
     data = {}
     titles = ['Played', 'PWR', 'BWR', 'TR']
+    for n, counts in counters.items():
+        played = counts.sum(axis=1)
+
+        # A small result is going to be statistically insignificant,
+        # see signature_stats for confidence intervals.
+        for code in np.flatnonzero(played >= MIN_PLAYED):
+            games_played = int(played[code])
+            player_wins, bank_wins, ties = counts[code].tolist()
+            player_win_ratio = round(player_wins / games_played * 100, 2)
+            bank_win_ratio = round(bank_wins / games_played * 100, 2)
+            tie_ratio = round(ties / games_played * 100, 2)
+
+            if any(ratio > threshold for ratio, threshold in zip(
+                    (player_win_ratio, bank_win_ratio, tie_ratio), WIN_RATIO_THRESHOLDS)):
+                data[signature_label(code, n)] = [games_played, player_win_ratio, bank_win_ratio, tie_ratio]
+
+    return DataFrame(data=data, index=titles)
+
+
+def signature_stats(counters, alpha=0.05, looks=1, min_played=MIN_PLAYED, odds_sums=None):
+    """
+    Estimate win ratios of every signature with confidence intervals.
+
+    Intervals are Wilson score intervals, Bonferroni corrected over all 3
+    ratios of all signatures tested and over the number of times the stats
+    are looked at, so stopping at any look keeps the overall error rate
+    under alpha.
+
+    With odds_sums, win ratios are estimated with control variates instead.
+    Wins minus exact odds of each game average to zero following any
+    signature, since signatures only depend on games already played, so
+    subtracting them in the best proportion cancels out most of the luck of
+    the draw. Intervals are then normal intervals from shoe totals, as games
+    within a shoe are not independent.
+
+    A ratio is significant when its interval is above its threshold in
+    WIN_RATIO_THRESHOLDS, and resolved when the interval is either all above
+    or all below it. Signatures played fewer than min_played times are left
+    out.
+
+    :param dict counters: Counters as from new_counters.
+    :param float alpha: Overall chance of any false result.
+    :param int looks: Number of times stats are looked at during a run.
+    :param int min_played: Min number of games played to test a signature.
+    :param dict odds_sums: Sums as from new_odds_sums, for the same games as counters.
+    :return: DataFrame with one row per signature tested, ratios in percent.
+    """
     labels = []
-    for k in games_played_for_result_signatures:
-        games_played = games_played_for_result_signatures.get(k, 0)
+    rows = []
+    sum_rows = []
+    for n, counts in counters.items():
+        played = counts.sum(axis=1)
+        codes = np.flatnonzero(played >= max(min_played, 1))
+        labels += [signature_label(code, n) for code in codes]
+        rows.append(counts[codes])
+        if odds_sums is not None:
+            sum_rows.append(odds_sums[n][codes])
 
-        # A small result is going to be statistically insignificant.
-        # TODO: Implement formula for variance based on num_games
-        # TODO: Auto set results_to_track based on statistical significance
-        if games_played < 50000:
-            continue
+    wins = np.concatenate(rows) if rows else np.zeros((0, 3), dtype=np.int64)
+    sums = None
+    if odds_sums is not None:
+        sums = np.concatenate(sum_rows) if sum_rows else np.zeros((0, 7, 3))
+    return win_ratio_stats(labels, wins, alpha, looks, sums)
 
-        player_wins = player_wins_for_result_signatures.get(k, 0)
-        bank_wins = bank_wins_for_result_signatures.get(k, 0)
-        ties = ties_for_result_signatures.get(k, 0)
-        player_win_ratio = round(player_wins / games_played * 100, 2)
-        bank_win_ratio = round(bank_wins / games_played * 100, 2)
-        tie_ratio = round(ties / games_played * 100, 2)
 
-        # You can win at least $1.6 from player or tie on betting $100.
-        if player_win_ratio > 50.8 or bank_win_ratio > 53 or tie_ratio > 12.7:
-            labels.append(k)
-            data[k] = [games_played, player_win_ratio, bank_win_ratio, tie_ratio]
+def sketch_stats(sketch, alpha=0.05, looks=1, min_played=MIN_PLAYED):
+    """
+    Estimate win ratios of heavy hitters of a PatternSketch with confidence
+    intervals, same as signature_stats. Only games counted exactly since
+    signatures entered the heavy hitters table are used.
+
+    :param PatternSketch sketch: Sketch of long signatures.
+    :param float alpha: Overall chance of any false result.
+    :param int looks: Number of times stats are looked at during a run.
+    :param int min_played: Min number of games played to test a signature.
+    :return: DataFrame with one row per signature tested, ratios in percent.
+    """
+    sketch.flush()
+    tested = sketch.heavy_counts.sum(axis=1) >= max(min_played, 1)
+    labels = [signature_label(code, sketch.length) for code in sketch.heavy_codes[tested]]
+    return win_ratio_stats(labels, sketch.heavy_counts[tested], alpha, looks)
+
+
+def win_ratio_stats(labels, wins, alpha=0.05, looks=1, sums=None):
+    """
+    Work out win ratios with confidence intervals for signature_stats.
+
+    :param list labels: Signature labels.
+    :param numpy.ndarray wins: Player wins, bank wins and ties, one row per signature.
+    :param float alpha: Overall chance of any false result.
+    :param int looks: Number of times stats are looked at during a run.
+    :param numpy.ndarray sums: Sums of each signature as from new_odds_sums, for control variates.
+    :return: DataFrame with one row per signature, ratios in percent.
+    """
+    played = wins.sum(axis=1, keepdims=True)
+    z = NormalDist().inv_cdf(1 - alpha / (2 * max(wins.size, 1) * looks))
+
+    ratios = wins / np.maximum(played, 1)
+    if sums is None:
+        center = (ratios + z * z / (2 * played)) / (1 + z * z / played)
+        half = z * np.sqrt(ratios * (1 - ratios) / played + z * z / (4 * played * played)) / (1 + z * z / played)
+    else:
+        total_odds, wins_wins, odds_odds, wins_odds, games_games, games_wins, games_odds = sums.transpose(1, 0, 2)
+
+        # Shoe totals of wins off the ratio, and of wins minus odds, which average to zero.
+        off_off = wins_wins - 2 * ratios * games_wins + ratios * ratios * games_games
+        off_control = wins_wins - wins_odds - ratios * (games_wins - games_odds)
+        control_control = wins_wins - 2 * wins_odds + odds_odds
+        beta = np.divide(off_control, control_control, out=np.zeros_like(ratios), where=control_control > 0)
+
+        ratios = ratios - beta * (wins - total_odds) / played
+        center = ratios
+        half = z * np.sqrt(np.maximum(off_off - beta * off_control, 0)) / played
+    thresholds = np.array(WIN_RATIO_THRESHOLDS) / 100
+    low = center - half
+    high = center + half
+
+    df = DataFrame(index=labels)
+    df['Played'] = played[:, 0]
+    for i, title in enumerate(['PWR', 'BWR', 'TR']):
+        df[title] = np.round(ratios[:, i] * 100, 2)
+        df[title + ' low'] = np.round(low[:, i] * 100, 2)
+        df[title + ' high'] = np.round(high[:, i] * 100, 2)
+    df['Significant'] = (low > thresholds).any(axis=1)
+    df['Resolved'] = ((low > thresholds) | (high < thresholds)).all(axis=1)
+    return df
+
+
+def play_games(num_games, num_decks_in_shoe=8, decks_discarded=2, num_cards_to_discard=0,
+               results_to_track_min=5, results_to_track_max=8,
+               num_workers=1, num_shards=None, seed=None,
+               checkpoint_dir=None, checkpoint_every=1000000, results_path=None,
+               alpha=None, check_every=None, record_dir=None, control=False, sketch=None,
+               progress_every=None, position_bucket=None):
+    """
+    Play multiple games and print statistics.
+
+    Games are split into shards, each played from fresh shoes with its own
+    random stream, and the counters of all shards are merged in order. The
+    result only depends on num_shards and seed, so a seeded run gives the same
+    DataFrame no matter how many workers played the shards.
+
+    With alpha set, signatures are tested with signature_stats instead, and
+    with check_every also set games are played in rounds of check_every
+    games, stopping as soon as every signature tested is resolved.
+
+    With record_dir set, each shard also records its results there, to be
+    analyzed again later with replay_counters.
+
+    With control set, exact odds of every game are worked out too, and
+    signatures are tested by signature_stats with control variates. Each
+    game costs more to play, but edges are resolved in far fewer games.
+
+    With sketch set, each shard also counts long signatures in an empty copy
+    of it, and the copies are merged into it. Its heavy hitters are printed
+    as well, tested with sketch_stats if alpha is set.
+
+    With position_bucket set, signatures are also tested in every bucket of
+    position_bucket cards left in the shoe with position_stats, printing
+    the significant ones if alpha is set and those with win ratios over
+    WIN_RATIO_THRESHOLDS otherwise.
+
+    With progress_every set, a ProgressReporter prints progress of all shards
+    to stderr every progress_every seconds.
+
+    :param int num_games: Number of games to play.
+    :param int num_decks_in_shoe: Number of decks to use.
+    :param int decks_discarded: Number of decks to cut, at which time reshuffle will happen.
+    :param int num_cards_to_discard: Number of cards to discard per game at start of dealing.
+    :param int results_to_track_min: Min length of results to track.
+    :param int results_to_track_max: Max length of results to track.
+    :param int num_workers: Number of processes to play shards in.
+    :param int num_shards: Number of shards to split games into, defaults to num_workers.
+    :param int seed: Seed for fast reproducible runs with numpy, None to shuffle with SystemRandom.
+    :param str checkpoint_dir: Directory to save and resume shard checkpoints in.
+    :param int checkpoint_every: Number of games between checkpoints of each shard.
+    :param str results_path: File to save merged counters to, for merge_result_files.
+    :param float alpha: Overall chance of any false result when testing signatures.
+    :param int check_every: Number of games between tests for stopping early, needs alpha.
+    :param str record_dir: Directory to record results of each shard in.
+    :param bool control: Whether to test signatures with control variates, needs alpha.
+    :param PatternSketch sketch: Sketch to count long signatures in.
+    :param float progress_every: Seconds between progress reports, None for no reports.
+    :param int position_bucket: Number of cards per bucket of cards left, None to not split by position.
+    :return: DataFrame of result signatures as printed.
+    """
+    num_shards = num_shards or num_workers
+    if check_every and alpha:
+        rounds = [check_every] * (num_games // check_every)
+        if num_games % check_every:
+            rounds.append(num_games % check_every)
+    else:
+        rounds = [num_games]
+
+    for path in (checkpoint_dir, record_dir):
+        if path:
+            os.makedirs(path, exist_ok=True)
+    seed_sequence = None if seed is None else np.random.SeedSequence(seed)
+    pool = Pool(num_workers) if num_workers > 1 else None
+    manager = Manager() if pool and progress_every else None
+    reporter = None
+    if progress_every:
+        reporter = ProgressReporter(num_games, progress_every, manager and manager.dict())
+        reporter.start()
+
+    counters = new_counters(results_to_track_min, results_to_track_max)
+    odds_sums = new_odds_sums(results_to_track_min, results_to_track_max) if control else None
+    position_counters = None
+    if position_bucket:
+        position_counters = new_position_counters(results_to_track_min, results_to_track_max, num_decks_in_shoe,
+                                                  position_bucket)
+    try:
+        for round_num, round_games in enumerate(rounds):
+            # Independent random streams per shard.
+            if seed_sequence is None:
+                shard_seeds = [None] * num_shards
+            else:
+                shard_seeds = seed_sequence.spawn(num_shards)
+
+            if len(rounds) == 1:
+                shard_names = ['shard-%d' % i for i in range(num_shards)]
+            else:
+                shard_names = ['round-%d-shard-%d' % (round_num, i) for i in range(num_shards)]
+            checkpoint_paths = [checkpoint_dir and os.path.join(checkpoint_dir, name + '.npz') for name in shard_names]
+            record_paths = [record_dir and os.path.join(record_dir, name + '.pbt') for name in shard_names]
+
+            games_per_shard, extra_games = divmod(round_games, num_shards)
+            shard_args = [
+                (games_per_shard + (1 if i < extra_games else 0), num_decks_in_shoe, decks_discarded,
+                 num_cards_to_discard, results_to_track_min, results_to_track_max, shard_seeds[i],
+                 checkpoint_paths[i], checkpoint_every, record_paths[i], control,
+                 sketch and PatternSketch(*sketch.settings), reporter and reporter.shared, shard_names[i],
+                 progress_every, position_bucket)
+                for i in range(num_shards)
+            ]
+
+            if pool:
+                shard_counters = pool.starmap(play_games_shard, shard_args)
+            else:
+                shard_counters = [play_games_shard(*args) for args in shard_args]
+
+            for other in shard_counters:
+                if control or sketch or position_bucket:
+                    other, extras = other
+                    if control:
+                        merge_counters(odds_sums, extras['odds_sums'])
+                    if sketch:
+                        sketch.merge(extras['sketch'])
+                    if position_bucket:
+                        merge_counters(position_counters, extras['position_counters'])
+                merge_counters(counters, other)
+
+            if len(rounds) > 1:
+                # Leave out signatures on track to be played too few times by the end of the run.
+                games_played = sum(rounds[:round_num + 1])
+                stats = signature_stats(counters, alpha, len(rounds), MIN_PLAYED * games_played // num_games, odds_sums)
+                if len(stats) and stats['Resolved'].all():
+                    print('All %d signatures resolved after %d games.' % (len(stats), games_played))
+                    break
+    finally:
+        if reporter:
+            reporter.stop()
+        if manager:
+            manager.shutdown()
+        if pool:
+            pool.close()
+
+    if results_path:
+        save_checkpoint(results_path, counters, odds_sums=odds_sums, sketch=sketch,
+                        position_counters=position_counters)
 
     # Print results
-    df = DataFrame(data=data, index=titles)
+    if alpha:
+        df = signature_stats(counters, alpha, looks=len(rounds), odds_sums=odds_sums)
+        df = df[df['Significant']]
+    else:
+        df = analyze_counters(counters)
     print(df)
+    if sketch:
+        if alpha:
+            sketch_df = sketch_stats(sketch, alpha, looks=len(rounds))
+            print(sketch_df[sketch_df['Significant']])
+        else:
+            print(sketch.heavy_hitters())
+    if position_bucket:
+        position_df = position_stats(position_counters, alpha or 0.05, len(rounds), bucket_size=position_bucket)
+        if alpha:
+            print(position_df[position_df['Significant']])
+        else:
+            thresholds = np.array(WIN_RATIO_THRESHOLDS)
+            print(position_df[(position_df[['PWR', 'BWR', 'TR']].to_numpy() > thresholds).any(axis=1)])
+    return df
+
+
+def run_benchmarks(scale=1, repeat=5):
+    """
+    Time the main parts of the simulation.
+
+    Each benchmark is timed repeat times and the best time is kept, so
+    background noise only ever makes a result look slower than it is.
+
+    :param float scale: Multiplier on the amount of work per benchmark.
+    :param int repeat: Number of times to time each benchmark.
+    :return: Dict of benchmark name to throughput in items per second.
+    """
+    rng = make_rng(0)
+    num_shoes = max(int(200 * scale), 1)
+    num_games = max(int(100000 * scale), 1)
+    shoes = [prepare_cards(8, rng) for _ in range(num_shoes)]
+    shoe_array = np.array(shoes, dtype=np.int8)
+    shoe_results = [Shoe(cards=cards).play() for cards in shoes]
+    games_in_shoes = sum(len(results) for results in shoe_results)
+    outcome_table()
 
+    record_dir = tempfile.TemporaryDirectory()
+    record_path = os.path.join(record_dir.name, 'bench.pbt')
+    with OutcomeRecorder(record_path) as recorder:
+        for results in shoe_results:
+            recorder.write_shoe(results)
+    strategies = betting_strategies()
 
-play_games(500000000, results_to_track_min=7, results_to_track_max=9)
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=repeat))
+
+    def play_scalar():
+        for cards in shoes:
+            cards = list(cards)
+            while len(cards) > 2 * 13 * 4:
+                play_game(cards)
+
+    def play_shoes():
+        for cards in shoes:
+            Shoe(cards=cards).play()
+
+    def count(results_to_track_min, results_to_track_max):
+        def func():
+            counters = new_counters(results_to_track_min, results_to_track_max)
+            for results in shoe_results:
+                count_signatures(counters, results)
+        return func
+
+    benchmarks = {
+        'shuffle SystemRandom (shoes/s)': (lambda: [prepare_cards(8) for _ in range(num_shoes)], num_shoes),
+        'shuffle numpy (shoes/s)': (lambda: [prepare_cards(8, rng) for _ in range(num_shoes)], num_shoes),
+        'shuffle numpy batch (shoes/s)': (lambda: prepare_shoes(num_shoes, 8, rng), num_shoes),
+        'play_game (games/s)': (play_scalar, games_in_shoes),
+        'Shoe.play (games/s)': (play_shoes, games_in_shoes),
+        'play_shoes_batch (games/s)': (lambda: play_shoes_batch(shoe_array), games_in_shoes),
+        'count signatures 5-8 (games/s)': (count(5, 8), games_in_shoes),
+        'count signatures 7-9 (games/s)': (count(7, 9), games_in_shoes),
+        'count signatures 1-12 (games/s)': (count(1, 12), games_in_shoes),
+        'replay signatures 7-9 (games/s)': (lambda: replay_counters([record_path], 7, 9), games_in_shoes),
+        'backtest strategies (games/s)': (lambda: backtest([record_path], strategies), games_in_shoes),
+        'play_games_shard 7-9 (games/s)': (
+            lambda: play_games_shard(num_games, results_to_track_min=7, results_to_track_max=9, seed=0), num_games),
+    }
+    try:
+        return {name: items / best(func) for name, (func, items) in benchmarks.items()}
+    finally:
+        record_dir.cleanup()
+
+
+def check_benchmarks(results, history_path, tolerance=0.2):
+    """
+    Compare benchmark results with the last run saved in a history file, then
+    add them to it.
+
+    :param dict results: Results as from run_benchmarks.
+    :param str history_path: JSON file of past runs.
+    :param float tolerance: Fraction of throughput that can be lost before it counts as a slowdown.
+    :return: Dict of benchmark name to fraction of last run's throughput, for slowdowns only.
+    """
+    history = []
+    if os.path.exists(history_path):
+        with open(history_path) as f:
+            history = json.load(f)
+
+    slowdowns = {}
+    if history:
+        last = history[-1]['results']
+        for name, throughput in results.items():
+            if name in last and throughput < last[name] * (1 - tolerance):
+                slowdowns[name] = throughput / last[name]
+
+    history.append({
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'results': results,
+    })
+    with open(history_path, 'w') as f:
+        json.dump(history, f, indent=2)
+    return slowdowns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Simulate mini-baccarat and look for result signatures worth betting on.')
+    parser.add_argument('-n', '--num-games', type=int, default=500000000, help='Number of games to play.')
+    parser.add_argument('--min', type=int, default=7, help='Min length of results to track.')
+    parser.add_argument('--max', type=int, default=9, help='Max length of results to track.')
+    parser.add_argument('-w', '--workers', type=int, default=cpu_count(), help='Number of processes to play in.')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for reproducible runs, SystemRandom if unset.')
+    parser.add_argument('-c', '--checkpoint-dir', default=None,
+                        help='Directory to save checkpoints in and resume from.')
+    parser.add_argument('-o', '--results', default=None, help='File to save merged counters to.')
+    parser.add_argument('--alpha', type=float, default=None,
+                        help='Test signatures with confidence intervals at this overall error rate.')
+    parser.add_argument('--check-every', type=int, default=None,
+                        help='Stop early once all signatures are resolved, testing every this many games.')
+    parser.add_argument('--merge', nargs='+', default=None, metavar='FILE',
+                        help='Analyze merged counters of result files instead of playing.')
+    parser.add_argument('--control', action='store_true',
+                        help='Test signatures with control variates from exact odds of every game, needs --alpha.')
+    parser.add_argument('--sketch-length', type=int, default=None,
+                        help='Also count signatures of this length in a fixed size sketch, for long signatures.')
+    parser.add_argument('--sketch-width', type=int, default=1 << 18, help='Number of buckets per row of the sketch.')
+    parser.add_argument('--sketch-depth', type=int, default=4, help='Number of rows of the sketch.')
+    parser.add_argument('--sketch-heavy', type=int, default=10000,
+                        help='Number of most played signatures to count exactly.')
+    parser.add_argument('--position-bucket', type=int, default=None, metavar='CARDS',
+                        help='Also test signatures by cards left in the shoe, in buckets of CARDS cards.')
+    parser.add_argument('--progress', type=float, default=None, metavar='SECONDS',
+                        help='Print progress to stderr every SECONDS.')
+    parser.add_argument('--record-dir', default=None, help='Directory to record results of each shard in.')
+    parser.add_argument('--replay', nargs='+', default=None, metavar='FILE',
+                        help='Analyze signatures of recorded results instead of playing.')
+    parser.add_argument('--backtest', nargs='+', default=None, metavar='FILE',
+                        help='Backtest betting strategies on recorded results instead of playing.')
+    parser.add_argument('--strategy-length', type=int, default=4, help='Length of signatures strategies bet on.')
+    parser.add_argument('--curves', default=None, metavar='FILE', help='File to save backtest bankroll curves to.')
+    parser.add_argument('--bench', default=None, metavar='FILE',
+                        help='Run benchmarks instead of playing, comparing with and adding to a JSON history file.')
+    parser.add_argument('--bench-scale', type=float, default=1, help='Multiplier on the amount of work per benchmark.')
+    parser.add_argument('--bench-tolerance', type=float, default=0.2,
+                        help='Fraction of throughput that can be lost before a benchmark fails.')
+    args = parser.parse_args()
+    pattern_sketch = None
+    if args.sketch_length:
+        pattern_sketch = PatternSketch(args.sketch_length, args.sketch_width, args.sketch_depth, args.sketch_heavy)
+
+    if args.bench:
+        bench_results = run_benchmarks(args.bench_scale)
+        print(DataFrame({'Throughput': bench_results}).round(1))
+        bench_slowdowns = check_benchmarks(bench_results, args.bench, args.bench_tolerance)
+        if bench_slowdowns:
+            for bench_name, ratio in bench_slowdowns.items():
+                print('SLOWDOWN: %s at %.0f%% of last run' % (bench_name, ratio * 100))
+            sys.exit(1)
+    elif args.backtest:
+        strategies = betting_strategies(args.strategy_length)
+        backtest_df, bankroll_curves = backtest(args.backtest, strategies, args.strategy_length)
+        print(backtest_df.sort_values('EV', ascending=False))
+        if args.curves:
+            np.savez(args.curves, names=np.array(list(strategies)), curves=bankroll_curves)
+    elif args.merge or args.replay:
+        merged_odds_sums = None
+        merged_positions = None
+        if args.merge:
+            merged_files = merge_result_files(args.merge)
+            merged = merged_files['counters']
+            merged_odds_sums = merged_files['odds_sums']
+            merged_positions = merged_files['position_counters']
+            if pattern_sketch:
+                pattern_sketch = merged_files['sketch']
+                if pattern_sketch is None:
+                    parser.error('--sketch-length needs a sketch in every file merged.')
+            if args.position_bucket and merged_positions is None:
+                parser.error('--position-bucket needs position counters in every file merged.')
+        else:
+            merged = replay_counters(args.replay, args.min, args.max)
+            if pattern_sketch:
+                replay_sketch(args.replay, pattern_sketch)
+        if args.results:
+            save_checkpoint(args.results, merged, odds_sums=merged_odds_sums, sketch=pattern_sketch,
+                            position_counters=merged_positions)
+        if args.alpha:
+            stats = signature_stats(merged, args.alpha, odds_sums=merged_odds_sums)
+            print(stats[stats['Significant']])
+        else:
+            print(analyze_counters(merged))
+        if pattern_sketch and args.alpha:
+            stats = sketch_stats(pattern_sketch, args.alpha)
+            print(stats[stats['Significant']])
+        elif pattern_sketch:
+            print(pattern_sketch.heavy_hitters())
+        if args.position_bucket and merged_positions is not None:
+            stats = position_stats(merged_positions, args.alpha or 0.05, bucket_size=args.position_bucket)
+            if args.alpha:
+                print(stats[stats['Significant']])
+            else:
+                print(stats[(stats[['PWR', 'BWR', 'TR']].to_numpy() > np.array(WIN_RATIO_THRESHOLDS)).any(axis=1)])
+    else:
+        play_games(args.num_games, results_to_track_min=args.min, results_to_track_max=args.max,
+                   num_workers=args.workers, seed=args.seed, checkpoint_dir=args.checkpoint_dir,
+                   results_path=args.results, alpha=args.alpha, check_every=args.check_every,
+                   record_dir=args.record_dir, control=args.control, sketch=pattern_sketch,
+                   progress_every=args.progress, position_bucket=args.position_bucket)
 
 # Result is empty data... nothing with sufficient plays satisfied the meager 101.6/100 requirement.